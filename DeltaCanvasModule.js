@@ -0,0 +1,71 @@
+const DeltaCanvasModule = function(canvas_width, canvas_height, grid_width, grid_height) {
+    const createCanvas = () => {
+        const canvas = document.createElement('canvas');
+        Object.assign(canvas, {
+            width: canvas_width,
+            height: canvas_height,
+            className: 'world-grid',
+        });
+        return canvas;
+    };
+
+    const parent = document.createElement('div');
+    Object.assign(parent, {
+        style: `height:${canvas_height}px;`,
+        className: 'world-grid-parent',
+    });
+
+    const canvas = createCanvas();
+    const interactionCanvas = createCanvas();
+    parent.appendChild(canvas);
+    parent.appendChild(interactionCanvas);
+    document.getElementById('elements').appendChild(parent);
+
+    const interactionHandler = new InteractionHandler(
+        canvas_width, canvas_height, grid_width, grid_height,
+        interactionCanvas.getContext('2d')
+    );
+    const canvasDraw = new GridVisualization(
+        canvas_width, canvas_height, grid_width, grid_height,
+        canvas.getContext('2d'), interactionHandler
+    );
+
+    // Portrayals currently on the grid, by key
+    const portrayals = new Map();
+
+    this.render = function(data) {
+        if (data == null) {
+            // Nothing changed since the previous frame
+            return;
+        }
+
+        if (data.keyframe) {
+            portrayals.clear();
+        }
+        for (const key of data.remove) {
+            portrayals.delete(key);
+        }
+        for (const key in data.update) {
+            portrayals.set(key, data.update[key]);
+        }
+
+        const layers = {};
+        for (const portrayal of portrayals.values()) {
+            if (!(portrayal.Layer in layers)) {
+                layers[portrayal.Layer] = [];
+            }
+            layers[portrayal.Layer].push(portrayal);
+        }
+
+        canvasDraw.resetCanvas();
+        for (const layer of Object.keys(layers).sort((a, b) => a - b)) {
+            canvasDraw.drawLayer(layers[layer]);
+        }
+        canvasDraw.drawGridLines('#eee');
+    };
+
+    this.reset = function() {
+        portrayals.clear();
+        canvasDraw.resetCanvas();
+    };
+};
@@ -83,15 +83,21 @@ const GenerationChartModule = function(series, canvas_width, canvas_height) {
 
     this.render = function(data) {
         if (data != null) {
-            chart.data.labels.push(generation++);
-            for (let i = 0; i < data.length; i++) {
-                chart.data.datasets[i].data.push(data[i]);
+            // One row of values for each generation since the last frame, starting at the
+            // generation of the first row
+            generation = data.generation;
+            for (const values of data.rows) {
+                chart.data.labels.push(generation++);
+                for (let i = 0; i < values.length; i++) {
+                    chart.data.datasets[i].data.push(values[i]);
+                }
             }
             chart.update();
         }
     };
   
     this.reset = function() {
+        generation = 1;
         while (chart.data.labels.length) {
             chart.data.labels.pop();
         }
@@ -47,8 +47,10 @@ const HistogramModule = function(bins, canvasWidth, canvasHeight, label, color)
     let chart = new Chart(context, {type: 'bar', data: data, options: options});
 
     this.render = function(data) {
-        datasets[0].data = data;
-        chart.update();
+        if (data != null) {
+            datasets[0].data = data;
+            chart.update();
+        }
     };
 
     this.reset = function() {
@@ -0,0 +1,140 @@
+import threading
+from typing import Any, Dict, List
+
+import tornado.escape
+import tornado.ioloop
+from tornado.websocket import WebSocketClosedError
+from mesa.visualization.ModularVisualization import ModularServer, SocketHandler
+
+# Server that steps the model continuously in a background thread instead of once for every
+# frame the browser asks for. Frames are rendered by the worker at the first tick ('frame'
+# sampling, so at the frame rate set in the page) or at the first generation boundary
+# ('generation' sampling) after the browser asks for them, so the model is only ever touched
+# by one thread while it runs and no tick is rendered unless it is shown. The worker pauses
+# when no browser has asked for a frame for IDLE_TICKS ticks (the page was stopped or closed)
+# and is started again by the next request.
+class BackgroundServer(ModularServer):
+    SAMPLING = ('frame', 'generation')
+    IDLE_TICKS = 120  # A generation of the natural selection model
+
+    def __init__(self, model_cls, visualization_elements, name: str = 'Mesa Model',
+            model_params: Dict[str, Any] = None, port: int = None, sampling: str = 'generation'):
+        if sampling not in BackgroundServer.SAMPLING:
+            raise ValueError(f'unknown sampling: {sampling}')
+
+        self.sampling = sampling
+        self.worker = None
+        self.io_loop = None
+
+        # Sockets waiting for a frame, shared with the worker
+        self.waiting: List[SocketHandler] = []
+        self.waiting_lock = threading.Lock()
+
+        super().__init__(model_cls, visualization_elements, name, model_params, port)
+
+        # Takes precedence over the socket handler registered by ModularServer
+        self.add_handlers(r'.*', [(r'/ws', BackgroundSocketHandler)])
+
+    def reset_model(self):
+        self.stop_worker()
+        super().reset_model()
+
+    def stop_worker(self):
+        with self.waiting_lock:
+            worker, self.worker = self.worker, None
+            self.waiting.clear()
+
+        if worker is not None:
+            worker.stopped.set()
+            worker.join()
+
+    def request_frame(self, handler: SocketHandler):
+        # Called from the IO loop when the browser asks for the next frame
+        self.io_loop = tornado.ioloop.IOLoop.current()
+
+        with self.waiting_lock:
+            if self.worker is None:
+                self.worker = SimulationWorker(self)
+                self.worker.start()
+
+            if not self.worker.finished:
+                self.waiting.append(handler)
+                return
+
+        send(handler, {'type': 'end'})
+
+    def pause(self, worker: 'SimulationWorker') -> bool:
+        # Called from the worker once nobody has asked for a frame for IDLE_TICKS ticks. The
+        # worker stops unless a request came in meanwhile.
+        with self.waiting_lock:
+            if self.waiting or self.worker is not worker:
+                return False
+            self.worker = None
+            return True
+
+    def socket_closed(self, handler: SocketHandler):
+        # Called from the IO loop. The worker is stopped when no other page is waiting for it
+        # (pages that are between frames start it again with their next request).
+        with self.waiting_lock:
+            if handler in self.waiting:
+                self.waiting.remove(handler)
+            idle = not self.waiting
+
+        if idle:
+            self.stop_worker()
+
+    def deliver(self, message: Dict[str, Any]):
+        # Called from the worker, which is the only thread using the model while it runs
+        with self.waiting_lock:
+            waiting, self.waiting = self.waiting, []
+
+        for handler in waiting:
+            self.io_loop.add_callback(send, handler, message)
+
+class SimulationWorker(threading.Thread):
+    def __init__(self, server: BackgroundServer) -> None:
+        super().__init__(daemon=True)
+        self.server = server
+        self.stopped = threading.Event()
+        self.finished = False
+
+    def run(self):
+        server = self.server
+        model = server.model
+        every_tick = server.sampling == 'frame'
+
+        idle = 0
+        while model.running and not self.stopped.is_set():
+            model.step()
+
+            if server.waiting:
+                idle = 0
+                if every_tick or model.step_count == 0:
+                    server.deliver({'type': 'viz_state', 'data': server.render_model()})
+            else:
+                idle += 1
+                if idle >= BackgroundServer.IDLE_TICKS and server.pause(self):
+                    return
+
+        with server.waiting_lock:
+            self.finished = True
+        if not self.stopped.is_set():
+            server.deliver({'type': 'end'})
+
+class BackgroundSocketHandler(SocketHandler):
+    def on_message(self, message):
+        msg = tornado.escape.json_decode(message)
+
+        if msg['type'] == 'get_step':
+            self.application.request_frame(self)
+        else:
+            super().on_message(message)
+
+    def on_close(self):
+        self.application.socket_closed(self)
+
+def send(handler: SocketHandler, message: Dict[str, Any]):
+    try:
+        handler.write_message(message)
+    except WebSocketClosedError:
+        pass
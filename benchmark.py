@@ -0,0 +1,127 @@
+import json
+import sys
+import time
+from argparse import ArgumentParser, HelpFormatter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict
+
+from model import NSModel
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    'default': {},
+    'dense': {'width': 100, 'height': 100, 'num_organisms': 800, 'food_per_generation': 2500},
+    'all_trail': {'initial_trail': 1.0},
+    'high_awareness': {'initial_awareness': 6, 'awareness_mutation_rate': 0.0},
+    'dense_array': {
+        'width': 100, 'height': 100, 'num_organisms': 800, 'food_per_generation': 2500,
+        'engine': 'array'
+    },
+}
+
+SEED = 42
+
+def peak_memory_mb() -> float:
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_scenario(name: str, generations: int) -> Dict[str, Any]:
+    model = NSModel(seed=SEED, **SCENARIOS[name])
+    ticks = generations * NSModel.STEPS_PER_GENERATION
+    organisms = 0
+
+    start = time.perf_counter()
+    for _ in range(ticks):
+        # Organisms only (food is never stepped), counted the same way by both engines
+        organisms += model.num_organisms
+        model.step()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'generations': generations,
+        'seconds': elapsed,
+        'ticks_per_sec': ticks / elapsed,
+        'generations_per_sec': generations / elapsed,
+        'organisms_per_sec': organisms / elapsed,
+        'peak_memory_mb': peak_memory_mb(),
+    }
+
+def run_benchmarks(scenarios, generations: int) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    for name in scenarios:
+        # Each scenario runs alone in a fresh process, so that peak memory is its own
+        with ProcessPoolExecutor(1) as executor:
+            results[name] = executor.submit(run_scenario, name, generations).result()
+    return results
+
+def regressions(results, baseline, tolerance: float):
+    for name, result in results.items():
+        if name in baseline:
+            expected = baseline[name]['ticks_per_sec']
+            if result['ticks_per_sec'] < expected * (1 - tolerance):
+                yield name, result['ticks_per_sec'], expected
+
+def main():
+    def formatter(prog):
+        return HelpFormatter(prog, max_help_position=40)
+
+    parser = ArgumentParser(description='Natural selection simulation benchmarks',
+        formatter_class=formatter)
+
+    parser.add_argument('scenarios', metavar='SCENARIO', nargs='*', default=list(SCENARIOS),
+        help=f'scenarios to run (default: all of {", ".join(SCENARIOS)})')
+    parser.add_argument('-g', '--generations', metavar='G', type=int, default=5,
+        help='number of generations to simulate in each scenario')
+    parser.add_argument('-o', '--output', metavar='O', default=None,
+        help='file to save the results to (JSON)')
+    parser.add_argument('-b', '--baseline', metavar='B', default=None,
+        help='results file to compare against')
+    parser.add_argument('-t', '--tolerance', metavar='T', type=float, default=0.1,
+        help='allowed fraction of ticks/sec lost relative to the baseline')
+    parser.add_argument('--fail-on-regression', action='store_true',
+        help='exit with an error if any scenario is slower than the baseline allows')
+
+    args = parser.parse_args()
+
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f'unknown scenario: {name}')
+
+    results = run_benchmarks(args.scenarios, args.generations)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print(f'{"scenario":<16}{"ticks/s":>12}{"gens/s":>10}{"organisms/s":>14}{"peak MB":>10}{"vs base":>10}')
+    for name, result in results.items():
+        change = ''
+        if name in baseline:
+            change = f'{result["ticks_per_sec"] / baseline[name]["ticks_per_sec"] - 1:+.1%}'
+        memory = result['peak_memory_mb']
+        print(f'{name:<16}{result["ticks_per_sec"]:>12.1f}{result["generations_per_sec"]:>10.3f}'
+            f'{result["organisms_per_sec"]:>14.0f}{memory if memory is not None else float("nan"):>10.1f}'
+            f'{change:>10}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    slower = list(regressions(results, baseline, args.tolerance))
+    for name, actual, expected in slower:
+        print(f'regression in {name}: {actual:.1f} ticks/s (baseline {expected:.1f})', file=sys.stderr)
+
+    if slower and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import filecmp
+import os
+import sys
+import tempfile
+from argparse import ArgumentParser, HelpFormatter
+from typing import Any, Dict
+
+from headless import run_headless
+
+# Model arguments of each engine whose resumed runs are checked
+ENGINES = {
+    'agents': {},
+    'sparse': {'sparse': True},
+    'array': {'engine': 'array'},
+}
+
+def check_resume(model_args: Dict[str, Any], generations: int, directory: str) -> bool:
+    # A run interrupted halfway (right after a checkpoint) and resumed must write the same
+    # output as the uninterrupted run
+    full = os.path.join(directory, 'full.csv')
+    resumed = os.path.join(directory, 'resumed.csv')
+    checkpoint = os.path.join(directory, 'run.ckpt')
+    half = max(1, generations // 2)
+
+    run_headless(model_args, generations, full)
+    run_headless(model_args, half, resumed, checkpoint=checkpoint, checkpoint_every=half)
+    run_headless(model_args, generations, resumed, resume=checkpoint)
+
+    return filecmp.cmp(full, resumed, shallow=False)
+
+def main():
+    def formatter(prog):
+        return HelpFormatter(prog, max_help_position=40)
+
+    parser = ArgumentParser(description='Check that resumed runs match uninterrupted runs',
+        formatter_class=formatter)
+
+    parser.add_argument('engines', metavar='ENGINE', nargs='*', default=list(ENGINES),
+        help=f'engines to check (default: all of {", ".join(ENGINES)})')
+    parser.add_argument('-g', '--generations', metavar='G', type=int, default=20,
+        help='number of generations of each run (checkpointed halfway)')
+    parser.add_argument('-s', '--seed', metavar='S', type=int, default=5,
+        help='seed of the runs')
+
+    args = parser.parse_args()
+
+    for engine in args.engines:
+        if engine not in ENGINES:
+            parser.error(f'unknown engine: {engine}')
+
+    failed = False
+    for engine in args.engines:
+        with tempfile.TemporaryDirectory() as directory:
+            same = check_resume({'seed': args.seed, **ENGINES[engine]}, args.generations,
+                directory)
+        print(f'{engine:<10}{"ok" if same else "MISMATCH"}')
+        failed = failed or not same
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import os
+import pickle
+import zlib
+from array import array
+from typing import Any, Dict
+
+from model import Food, NSModel, Organism
+
+MAGIC = b'NSCK1'
+
+# Checkpoints are taken at generation boundaries, where organisms have just been reset, food
+# has just been placed and there are no trails, so only a few values per agent are needed.
+# Agents are stored in schedule order, which is also the order they were placed in each cell.
+
+def agent_state(model: NSModel) -> Dict[str, Any]:
+    organisms = [agent for agent in model.schedule.agents if isinstance(agent, Organism)]
+    food = [agent for agent in model.schedule.agents if isinstance(agent, Food)]
+
+    return {
+        'organisms': {
+            'unique_id': array('q', (o.unique_id for o in organisms)),
+            'x': array('l', (o.pos[0] for o in organisms)),
+            'y': array('l', (o.pos[1] for o in organisms)),
+            'speed': array('b', (o.speed for o in organisms)),
+            'awareness': array('b', (o.awareness for o in organisms)),
+            'size': array('d', (o.size for o in organisms)),
+            'trail': array('b', (o.trail for o in organisms)),
+            'age': array('l', (o.age for o in organisms)),
+            'move_ticks': array('b', (o.next_move - model.schedule.time + 1 for o in organisms)),
+            'trail_length': array('b', (o.trail_length for o in organisms)),
+        },
+        'food': {
+            'unique_id': array('q', (f.unique_id for f in food)),
+            'x': array('l', (f.pos[0] for f in food)),
+            'y': array('l', (f.pos[1] for f in food)),
+            'amount': array('d', (f.amount for f in food)),
+        },
+        'stats': (model.stats.count, dict(model.stats.sums)),
+    }
+
+def restore_agents(model: NSModel, state: Dict[str, Any]):
+    for agent in model.schedule.agents:
+        model.remove_agent(agent)
+    model.trails.clear()
+
+    organisms = state['organisms']
+    for i in range(len(organisms['unique_id'])):
+        organism = Organism(model, organisms['speed'][i], organisms['awareness'][i],
+            organisms['size'][i], bool(organisms['trail'][i]))
+        organism.unique_id = organisms['unique_id'][i]
+        organism.age = organisms['age'][i]
+        organism.next_move = model.schedule.time + organisms['move_ticks'][i] - 1
+        organism.trail_length = organisms['trail_length'][i]
+
+        model.schedule.add(organism)
+        model.stats.add(organism)
+        model.grid.place_agent(organism, (organisms['x'][i], organisms['y'][i]))
+
+    food = state['food']
+    for i in range(len(food['unique_id'])):
+        agent = Food(model, food['amount'][i])
+        agent.unique_id = food['unique_id'][i]
+        model.schedule.add(agent)
+        model.grid.place_agent(agent, (food['x'][i], food['y'][i]))
+
+    # Running sums are restored as they were, so reported averages don't drift in the last bits
+    model.stats.count, model.stats.sums = state['stats'][0], dict(state['stats'][1])
+
+def array_state(model: NSModel) -> Dict[str, Any]:
+    engine = model.arrays
+    return {
+        'fields': {field: getattr(engine, field) for field in engine.FIELDS},
+        'food': engine.food,
+        'next_id': engine.next_id,
+        'rng': engine.rng.bit_generator.state,
+    }
+
+def restore_arrays(model: NSModel, state: Dict[str, Any]):
+    engine = model.arrays
+    for field, values in state['fields'].items():
+        setattr(engine, field, values)
+    engine.food[:] = state['food']
+    engine.next_id = state['next_id']
+    engine.rng.bit_generator.state = state['rng']
+    engine.trail_strength.fill(0)
+    engine.reset()
+
+def save_checkpoint(model: NSModel, path: str):
+    # Energy, food eaten and trails aren't saved (see above)
+    if model.step_count != 0:
+        raise ValueError('checkpoints can only be saved at the start of a generation')
+
+    state = {
+        'parameters': model.parameters,
+        'max_energy': Organism.MAX_ENERGY,
+        'generation': model.generation,
+        'step_count': model.step_count,
+        'num_organisms': model.num_organisms,
+        'current_id': model.current_id,
+        'schedule': (model.schedule.steps, model.schedule.time),
+        'random': model.random.getstate(),
+        'data': [dict(dc.model_vars) for dc in model.data_collectors],
+        'metrics_position': model.metrics_sink.position() if model.metrics_sink else None,
+        'recording_position': model.recorder.position() if model.recorder else None,
+        'lineage_position': model.lineage.position() if model.lineage else None,
+        'agents': array_state(model) if model.arrays is not None else agent_state(model),
+    }
+    data = zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+    # Written to a temporary file first so that a crash never leaves a truncated checkpoint
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(data)
+    os.replace(temp_path, path)
+
+def load_checkpoint(path: str) -> NSModel:
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'not a checkpoint file: {path}')
+        state = pickle.loads(zlib.decompress(f.read()))
+
+    Organism.MAX_ENERGY = state['max_energy']
+    model = NSModel(**state['parameters'])
+
+    # Organisms are scheduled relative to the current tick
+    model.schedule.steps, model.schedule.time = state['schedule']
+
+    if model.arrays is not None:
+        restore_arrays(model, state['agents'])
+    else:
+        restore_agents(model, state['agents'])
+
+    model.generation = state['generation']
+    model.step_count = state['step_count']
+    model.num_organisms = state['num_organisms']
+    model.current_id = state['current_id']
+    model.random.setstate(state['random'])
+
+    for dc, model_vars in zip(model.data_collectors, state['data']):
+        dc.model_vars = model_vars
+
+    # Where the metrics output of the run was when the checkpoint was taken
+    model.metrics_position = state['metrics_position']
+    # And where its recording and lineage log were
+    model.recording_position = state['recording_position']
+    model.lineage_position = state['lineage_position']
+
+    return model
@@ -0,0 +1,108 @@
+import math
+from argparse import ArgumentParser, HelpFormatter
+from typing import Any, Dict
+
+import numpy as np
+
+from metrics import create_sink
+from model import NSModel, Organism
+from sweep import model_parameters, parse_parameter
+
+# Z score of 95% confidence intervals of the mean (normal approximation)
+Z_95 = 1.96
+
+def replicate_results(model: NSModel) -> Dict[str, np.ndarray]:
+    # Value of each of the model's reporters in each replicate
+    engine = model.arrays
+    return {
+        'Organisms': engine.counts(),
+        'Speed': engine.replicate_averages('speed'),
+        'Awareness': engine.replicate_averages('awareness'),
+        'Size': engine.replicate_averages('size'),
+        'Trail Percentage': 100 * engine.replicate_averages('trail'),
+        'Age': engine.replicate_averages('age'),
+    }
+
+def aggregate(results: Dict[str, np.ndarray]) -> Dict[str, float]:
+    record = {}
+    for name, values in results.items():
+        ci = Z_95 * float(values.std(ddof=1)) / math.sqrt(values.size) if values.size > 1 else 0.0
+        record[f'{name} Mean'] = float(values.mean())
+        record[f'{name} CI'] = ci
+    return record
+
+def run_ensemble(
+        model_args: Dict[str, Any], replicates: int, generations: int, output: str,
+        summary: str = None, batch_size: int = 100
+    ):
+    # All replicates are advanced together by a single array engine
+    model = NSModel(**model_args, engine='array', replicates=replicates)
+
+    per_replicate = create_sink(output, batch_size=batch_size * replicates)
+    aggregates = create_sink(summary, batch_size=batch_size) if summary else None
+
+    def report():
+        results = replicate_results(model)
+        for r in range(replicates):
+            record = {'Generation': model.generation, 'Replicate': r}
+            record.update((name, values[r].item()) for name, values in results.items())
+            per_replicate.write(record)
+
+        if aggregates is not None:
+            aggregates.write({'Generation': model.generation, **aggregate(results)})
+
+    try:
+        report()
+        for _ in range(generations):
+            for _ in range(NSModel.STEPS_PER_GENERATION):
+                model.step()
+            report()
+    finally:
+        per_replicate.close()
+        if aggregates is not None:
+            aggregates.close()
+
+def main():
+    def formatter(prog):
+        return HelpFormatter(prog, max_help_position=40)
+
+    parser = ArgumentParser(description='Lockstep ensemble of natural selection simulations',
+        formatter_class=formatter)
+
+    parser.add_argument('-p', '--param', metavar='NAME=V', action='append', default=[],
+        help='model parameter value shared by all replicates (can be repeated)')
+    parser.add_argument('-r', '--replicates', metavar='R', type=int, default=50,
+        help='number of replicates to run')
+    parser.add_argument('-g', '--generations', metavar='G', type=int, default=100,
+        help='number of generations to simulate')
+    parser.add_argument('-s', '--seed', metavar='S', type=int, default=None,
+        help='seed for the random number generator of the ensemble')
+    parser.add_argument('-e', '--energy', metavar='E', type=float, default=150.0,
+        help='starting (maximum) energy of organisms')
+    parser.add_argument('-o', '--output', metavar='O', default='ensemble.csv',
+        help='file to write the results of each replicate to')
+    parser.add_argument('-a', '--summary', metavar='A', default='ensemble_summary.csv',
+        help='file to write the mean and 95%% confidence interval of each result to')
+    parser.add_argument('--batch-size', metavar='B', type=int, default=100,
+        help='number of generations to buffer before writing them to the outputs')
+
+    args = parser.parse_args()
+
+    defaults = model_parameters()
+    model_args = {'seed': args.seed}
+    for param in args.param:
+        name, _, value = param.partition('=')
+        name = name.replace('-', '_')
+        if name not in defaults or name in ('engine', 'replicates'):
+            parser.error(f'unknown model parameter: {name}')
+        try:
+            model_args[name] = parse_parameter(defaults, name, value)
+        except ValueError as e:
+            parser.error(str(e))
+
+    Organism.MAX_ENERGY = args.energy
+    run_ensemble(model_args, args.replicates, args.generations, args.output, args.summary,
+        args.batch_size)
+
+if __name__ == '__main__':
+    main()
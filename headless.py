@@ -0,0 +1,104 @@
+from argparse import ArgumentParser
+from typing import Dict, Any, List
+
+from checkpoint import load_checkpoint
+from metrics import create_sink
+from model import NSModel
+
+def run_generations(model: NSModel, generations: int):
+    # Until the last generation, or until the model stops itself (see termination.py)
+    for _ in range(generations * NSModel.STEPS_PER_GENERATION):
+        model.step()
+        if not model.running:
+            break
+
+def run_model(model_args: Dict[str, Any], generations: int,
+        termination: Dict[str, Any] = None) -> NSModel:
+    # The model is closed (worker processes of tiles are stopped) but its data can still be read
+    model = NSModel(**model_args)
+    try:
+        if termination:
+            model.enable_termination(**termination)
+        run_generations(model, generations)
+    finally:
+        model.close()
+    return model
+
+def termination_reason(model: NSModel) -> str:
+    # Empty unless the run was stopped before its last generation
+    if model.termination is None or model.termination.reason is None:
+        return ''
+    return model.termination.reason
+
+def collected_data(model: NSModel) -> Dict[str, List[Any]]:
+    data = {}
+    for dc in model.data_collectors:
+        data.update(dc.model_vars)
+    return data
+
+def add_termination_arguments(parser: ArgumentParser):
+    parser.add_argument('--stop-on-extinction', action='store_true',
+        help='stop the run when the population goes extinct')
+    parser.add_argument('--max-organisms', metavar='N', type=int, default=None,
+        help='stop the run when the population grows past N organisms')
+    parser.add_argument('--converge-tolerance', metavar='T', type=float, default=None,
+        help='stop the run when the average genes and trail percentage stay within T')
+    parser.add_argument('--converge-window', metavar='W', type=int, default=10,
+        help='number of generations the averages must stay within the tolerance')
+
+def termination_criteria(args: Dict[str, Any]) -> Dict[str, Any]:
+    # Arguments of enable_termination, taken out of the parsed arguments (empty if none is set)
+    criteria = {
+        'extinction': args.pop('stop_on_extinction'),
+        'max_organisms': args.pop('max_organisms'),
+        'tolerance': args.pop('converge_tolerance'),
+        'window': args.pop('converge_window'),
+    }
+    if not criteria['extinction'] and criteria['max_organisms'] is None and \
+            criteria['tolerance'] is None:
+        return {}
+    return criteria
+
+def run_headless(
+        model_args: Dict[str, Any], generations: int, output: str,
+        checkpoint: str = None, checkpoint_every: int = 10, resume: str = None,
+        batch_size: int = 100, profile: str = None, record: str = None,
+        termination: Dict[str, Any] = None, lineage: str = None
+    ):
+    if resume:
+        # Generations already simulated before the checkpoint count towards the total
+        model = load_checkpoint(resume)
+        generations = max(0, generations - (model.generation - 1))
+    else:
+        model = NSModel(**model_args)
+
+    if checkpoint:
+        model.enable_checkpoints(checkpoint, checkpoint_every)
+    if profile:
+        model.enable_profiling(profile)
+    if record:
+        model.enable_recording(record)
+    if termination:
+        model.enable_termination(**termination)
+    if lineage:
+        model.enable_lineage(lineage)
+
+    # Records are streamed to the output, so the model doesn't need to keep its history.
+    # A resumed run appends to the output of the original run.
+    sink = create_sink(output, batch_size=batch_size, append=bool(resume),
+        position=model.metrics_position)
+    model.attach_sink(sink, keep_history=False, write_current=not resume)
+
+    try:
+        run_generations(model, generations)
+    finally:
+        sink.close()
+        model.close()
+
+    if termination_reason(model):
+        print(f'Stopped at generation {model.generation}: {termination_reason(model)}')
+
+    if profile:
+        model.profiler.close()
+        for name, phase in model.profiler.report().items():
+            print(f'{name:<24}{phase["seconds"]:>10.3f} s{phase["calls"]:>10} calls')
@@ -0,0 +1,200 @@
+import mmap
+import os
+import struct
+import sys
+from argparse import ArgumentParser, HelpFormatter
+from collections import namedtuple
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+from mesa import Agent
+
+MAGIC = b'NSLN1'
+
+# Lineages are logged as two append-only tables of fixed-width records: births (path) and deaths
+# (path + '.deaths'). Organisms of the model when logging starts are logged as founders, with
+# no parent, and every replica as it is born. Since unique ids only grow, births are sorted by
+# id and ancestors are found by binary search on the memory-mapped table, without loading it.
+
+Birth = namedtuple('Birth', ('unique_id', 'parent', 'generation', 'size', 'speed', 'awareness',
+    'trail'))
+Death = namedtuple('Death', ('unique_id', 'predator', 'generation', 'cause'))
+
+# Id, parent id (-1 for founders), generation the organism was born into, then its genes
+BIRTH = struct.Struct('=qqifbb?x')
+# Id, id of the organism that ate it (-1 for starvation), generation and cause
+DEATH = struct.Struct('=qqibxxx')
+# Magic and whether the file is big endian
+HEADER = struct.Struct('=5s?xx')
+
+NO_PARENT = -1
+
+STARVATION = 0
+PREDATION = 1
+CAUSES = ('starvation', 'predation')
+
+def deaths_path(path: str) -> str:
+    return path + '.deaths'
+
+class LineageRecorder:
+    def __init__(self, path: str, position: Tuple[int, int] = None) -> None:
+        # A run resumed from a checkpoint appends to its log, from where it was when the
+        # checkpoint was taken, and has no founders of its own
+        self.resumed = position is not None and os.path.exists(path) and \
+            os.path.exists(deaths_path(path))
+        if self.resumed:
+            os.truncate(path, position[0])
+            os.truncate(deaths_path(path), position[1])
+            self.births = open(path, 'ab')
+            self.deaths = open(deaths_path(path), 'ab')
+            return
+
+        self.births = open(path, 'wb')
+        self.deaths = open(deaths_path(path), 'wb')
+
+        header = HEADER.pack(MAGIC, sys.byteorder == 'big')
+        self.births.write(header)
+        self.deaths.write(header)
+
+    def founders(self, organisms: Iterable[Agent], generation: int):
+        for organism in sorted(organisms, key=lambda organism: organism.unique_id):
+            self.birth(organism, None, generation)
+
+    def birth(self, organism: Agent, parent: Optional[Agent], generation: int):
+        self.births.write(BIRTH.pack(organism.unique_id,
+            parent.unique_id if parent is not None else NO_PARENT, generation, organism.size,
+            organism.speed, organism.awareness, organism.trail))
+
+    def death(self, organism: Agent, generation: int, predator: Optional[Agent] = None):
+        if predator is None:
+            self.deaths.write(DEATH.pack(organism.unique_id, NO_PARENT, generation, STARVATION))
+        else:
+            self.deaths.write(DEATH.pack(organism.unique_id, predator.unique_id, generation,
+                PREDATION))
+
+    def position(self) -> Tuple[int, int]:
+        # Size of both tables after a flush
+        self.births.flush()
+        self.deaths.flush()
+        return self.births.tell(), self.deaths.tell()
+
+    def close(self):
+        self.births.close()
+        self.deaths.close()
+
+class Table:
+    def __init__(self, path: str, record: struct.Struct) -> None:
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        self.record = record
+
+        magic, big_endian = HEADER.unpack_from(self.view, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a lineage log')
+        if big_endian != (sys.byteorder == 'big'):
+            raise ValueError(f'{path} was logged on a machine with a different byte order')
+
+        # Only records that were completely written are read, in case the run was interrupted
+        self.count = (len(self.map) - HEADER.size) // record.size
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int):
+        return self.record.unpack_from(self.view, HEADER.size + i * self.record.size)
+
+    def scan(self, start: int = 0) -> Iterator:
+        # Records from the given position on, read in place
+        end = HEADER.size + self.count * self.record.size
+        return self.record.iter_unpack(self.view[HEADER.size + start * self.record.size:end])
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+class LineageReader:
+    def __init__(self, path: str) -> None:
+        self.births = Table(path, BIRTH)
+        self.deaths = Table(deaths_path(path), DEATH)
+
+    def index(self, unique_id: int) -> int:
+        # Position of the first birth with an id not less than the given one
+        low, high = 0, len(self.births)
+        while low < high:
+            mid = (low + high) // 2
+            if self.births[mid][0] < unique_id:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def birth(self, unique_id: int) -> Optional[Birth]:
+        i = self.index(unique_id)
+        if i < len(self.births) and self.births[i][0] == unique_id:
+            return Birth(*self.births[i])
+        return None
+
+    def ancestors(self, unique_id: int) -> List[Birth]:
+        # The organism and its ancestors, up to its founder
+        lineage = []
+        birth = self.birth(unique_id)
+        while birth is not None:
+            lineage.append(birth)
+            birth = self.birth(birth.parent) if birth.parent != NO_PARENT else None
+        return lineage
+
+    def descendants(self, unique_id: int) -> List[Birth]:
+        # Descendants are always born after their ancestors, so a single pass finds them all
+        lineage: Set[int] = {unique_id}
+        found = []
+        for record in self.births.scan(self.index(unique_id + 1)):
+            if record[1] in lineage:
+                lineage.add(record[0])
+                found.append(Birth(*record))
+        return found
+
+    def deaths_of(self, unique_ids: Iterable[int]) -> List[Death]:
+        unique_ids = set(unique_ids)
+        return [Death(*record) for record in self.deaths.scan() if record[0] in unique_ids]
+
+    def close(self):
+        self.births.close()
+        self.deaths.close()
+
+def main():
+    def formatter(prog):
+        return HelpFormatter(prog, max_help_position=40)
+
+    parser = ArgumentParser(description='Ancestry of organisms in a lineage log',
+        formatter_class=formatter)
+
+    parser.add_argument('log', help='lineage log written by a run with --lineage')
+    parser.add_argument('ids', metavar='ID', type=int, nargs='+',
+        help='unique id of an organism')
+
+    args = parser.parse_args()
+
+    reader = LineageReader(args.log)
+    try:
+        for unique_id in args.ids:
+            ancestors = reader.ancestors(unique_id)
+            if not ancestors:
+                print(f'{unique_id}: not in the log')
+                continue
+
+            deaths = {death.unique_id: death for death in reader.deaths_of(
+                birth.unique_id for birth in ancestors)}
+            for birth in ancestors:
+                death = deaths.get(birth.unique_id)
+                fate = f'{CAUSES[death.cause]} in generation {death.generation}' \
+                    if death is not None else 'alive'
+                print(f'{birth.unique_id:>12}  generation {birth.generation:<6} '
+                    f'speed {birth.speed}  awareness {birth.awareness}  size {birth.size:.3f}  '
+                    f'trail {int(birth.trail)}  {fate}')
+            print()
+    finally:
+        reader.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import csv
+import json
+import os
+from typing import Any, Dict, List
+
+# Sinks receive one record per generation and write them out in batches, so that the output can
+# be followed while the simulation is running without keeping the whole history in memory.
+class MetricsSink:
+    def __init__(self, path: str, batch_size: int = 100, append: bool = False) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.append = append
+        self.buffer: List[Dict[str, Any]] = []
+
+    def write(self, record: Dict[str, Any]):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.write_batch(self.buffer)
+            self.buffer = []
+
+    def write_batch(self, records: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def position(self):
+        # Size of the output after a flush, or None if it can't be resumed from
+        return None
+
+    def close(self):
+        self.flush()
+
+class TextSink(MetricsSink):
+    def __init__(self, path: str, batch_size: int = 100, append: bool = False,
+            position: int = None) -> None:
+        super().__init__(path, batch_size, append)
+
+        # Records written after the position a run is resumed from are written again
+        if append and position is not None and os.path.exists(path):
+            os.truncate(path, position)
+        self.file = open(path, 'a' if append else 'w', newline='')
+
+    def position(self):
+        return self.file.tell()
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+class CSVSink(TextSink):
+    def __init__(self, path: str, batch_size: int = 100, append: bool = False,
+            position: int = None) -> None:
+        super().__init__(path, batch_size, append, position)
+        self.writer = csv.writer(self.file)
+        self.columns = None
+        self.write_header = self.file.tell() == 0
+
+    def write_batch(self, records: List[Dict[str, Any]]):
+        if self.columns is None:
+            self.columns = list(records[0].keys())
+            if self.write_header:
+                self.writer.writerow(self.columns)
+
+        self.writer.writerows([record[c] for c in self.columns] for record in records)
+        self.file.flush()
+
+class JSONLinesSink(TextSink):
+    def write_batch(self, records: List[Dict[str, Any]]):
+        self.file.write(''.join(json.dumps(record) + '\n' for record in records))
+        self.file.flush()
+
+class ArrowSink(MetricsSink):
+    # Arrow IPC stream (one record batch per flush, readable while it is being written) or
+    # Parquet file (one row group per flush, readable once the sink is closed)
+    def __init__(self, path: str, batch_size: int = 100, append: bool = False,
+            parquet: bool = False) -> None:
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('pyarrow is required to write Arrow and Parquet metrics') from None
+        if append:
+            raise ValueError('Arrow and Parquet metrics files can\'t be appended to')
+
+        super().__init__(path, batch_size, append)
+        self.pyarrow = pyarrow
+        self.parquet = parquet
+        self.writer = None
+
+    def write_batch(self, records: List[Dict[str, Any]]):
+        table = self.pyarrow.Table.from_pylist(records)
+
+        if self.writer is None:
+            if self.parquet:
+                import pyarrow.parquet
+                self.writer = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+            else:
+                import pyarrow.ipc
+                self.writer = pyarrow.ipc.new_stream(self.path, table.schema)
+
+        self.writer.write_table(table)
+
+    def close(self):
+        super().close()
+        if self.writer is not None:
+            self.writer.close()
+
+def create_sink(path: str, format: str = None, batch_size: int = 100,
+        append: bool = False, position: int = None) -> MetricsSink:
+    # The format is taken from the file extension if not given
+    if format is None:
+        format = os.path.splitext(path)[1].lstrip('.').lower()
+        format = {'json': 'jsonl', 'ndjson': 'jsonl'}.get(format, format)
+
+    if format == 'csv':
+        return CSVSink(path, batch_size, append, position)
+    elif format == 'jsonl':
+        return JSONLinesSink(path, batch_size, append, position)
+    elif format in ('arrow', 'parquet'):
+        return ArrowSink(path, batch_size, append, parquet=format == 'parquet')
+    else:
+        raise ValueError(f'unknown metrics format: {format}')
@@ -1,10 +1,16 @@
 
 from math import sqrt
-from typing import Tuple
+from operator import attrgetter
+from typing import Any, Dict, List, Optional, Tuple
 
 from mesa import Agent, DataCollector, Model
-from mesa.space import MultiGrid
-from mesa.time import RandomActivation
+
+from profiling import NO_PHASE, PhaseProfiler
+from scheduling import MoveScheduler
+from spatial import (IndexedGrid, SparseGrid, border_position, border_size, center_position,
+    center_size)
+from stats import PopulationStats
+from termination import Termination
 
 def squared_distance(pos1: Tuple[int, int], pos2: Tuple[int, int]) -> float:
     return pow(pos1[0] - pos2[0], 2) + pow(pos1[1] - pos2[1], 2)
@@ -15,27 +21,78 @@ def distance(pos1: Tuple[int, int], pos2: Tuple[int, int]) -> float:
 def clamp(val, lower, upper):
     return max(lower, min(val, upper))
 
-class PheromoneTrail(Agent):
+# Positions of food an organism won't go back to, shared by all organisms until they leave a
+# trail (only organisms with the trail gene ever do)
+NO_FOOD_POSITIONS = frozenset()
+
+# Trail left in a single cell of a TrailField
+class PheromoneTrail:
+    __slots__ = ('pos', 'creator', 'came_from', 'strength')
+
     MAX_STRENGTH = 10
 
-    def __init__(self, model: Model, creator: int, came_from: Tuple[int, int],
-            strength_reduction: int = 0) -> None:
-        super().__init__(model.next_id(), model)
+    def __init__(self, pos: Tuple[int, int], creator: int, came_from: Tuple[int, int],
+            strength: int) -> None:
+        self.pos = pos
         self.creator = creator
         self.came_from = came_from
-        self.strength = PheromoneTrail.MAX_STRENGTH - strength_reduction
+        self.strength = strength
+
+# Pheromone trails of the cells that have one, by position. Only the most recent trail left in
+# each cell is kept, and all trails decay together once per tick.
+class TrailField:
+    def __init__(self) -> None:
+        self.cells: Dict[Tuple[int, int], PheromoneTrail] = {}
+
+    def leave(self, pos: Tuple[int, int], creator: int, came_from: Tuple[int, int],
+            strength_reduction: int = 0):
+        strength = PheromoneTrail.MAX_STRENGTH - strength_reduction
+        trail = self.cells.get(pos)
+        if trail is None:
+            self.cells[pos] = PheromoneTrail(pos, creator, came_from, strength)
+        else:
+            trail.creator = creator
+            trail.came_from = came_from
+            trail.strength = strength
 
-    def step(self):
-        self.strength -= 1
-        if self.strength == 0:
-            self.model.agents_to_remove.add(self)
+    def get(self, pos: Tuple[int, int]) -> Optional[PheromoneTrail]:
+        return self.cells.get(pos)
+
+    def decay(self):
+        faded = []
+        for pos, trail in self.cells.items():
+            trail.strength -= 1
+            if trail.strength == 0:
+                faded.append(pos)
+
+        for pos in faded:
+            del self.cells[pos]
 
+    def clear(self):
+        self.cells.clear()
+
+    def trails(self):
+        return iter(self.cells.values())
+
+# Agents declare slots for the attributes of Mesa's Agent too, so that their instances never
+# allocate a __dict__
 class Food(Agent):
+    __slots__ = ('unique_id', 'model', 'pos', 'amount')
+
     def __init__(self, model: Model, amount: float = 1.0):
         super().__init__(model.next_id(), model)
         self.amount = amount
 
+    def recycle(self, amount: float = 1.0):
+        # Reuses food that was removed from the model as new food
+        self.unique_id = self.model.next_id()
+        self.amount = amount
+
 class Organism(Agent):
+    __slots__ = ('unique_id', 'model', 'pos', 'speed', 'awareness', 'size', 'trail',
+        'trail_length', 'age', 'next_move', 'seen_version', 'energy', 'prob_survival',
+        'prob_replication', 'food_positions')
+
     MAX_ENERGY: float = 150.0
 
     MIN_SPEED: int = 1
@@ -54,51 +111,55 @@ class Organism(Agent):
     def __init__(self, model: Model, speed: int = 3, awareness: int = 2,
             size: float = 1.0, trail: bool = False):
         super().__init__(model.next_id(), model)
+        self.init(speed, awareness, size, trail)
 
+    def recycle(self, speed: int, awareness: int, size: float, trail: bool):
+        # Reuses an organism that was removed from the model as a new organism
+        self.unique_id = self.model.next_id()
+        self.init(speed, awareness, size, trail)
+
+    def init(self, speed: int, awareness: int, size: float, trail: bool):
         # Genes
         self.speed = speed
         self.awareness = awareness
         self.size = size
         self.trail = trail
 
-        self.food_positions = set()
         self.trail_length = 0
 
         self.age = 0
 
-        self.reset_move_ticks()
+        # Set by the scheduler
+        self.next_move = None
+        self.seen_version = -1
+
         self.reset()
 
-    def reset_move_ticks(self):
-        self.move_ticks = 1 + Organism.MAX_SPEED - self.speed
+    def move_interval(self) -> int:
+        return 1 + Organism.MAX_SPEED - self.speed
 
     def reset(self):
-        self.food_positions.clear()
+        self.food_positions = NO_FOOD_POSITIONS
         self.energy = Organism.MAX_ENERGY
         self.prob_survival = 0.0
         self.prob_replication = 0.0
 
     def move(self):
-        closest_threat, closest_food, strongest_trail = None, None, None
+        trail_strength, trail_came_from = 0, None
         next_pos = None
 
-        adjacent = self.model.grid.get_neighborhood(self.pos, moore=True)
-        visible = self.model.grid.get_neighborhood(self.pos, moore=False, radius=self.awareness)
+        grid = self.model.grid
+        adjacent = grid.adjacent(self.pos)
 
         # Determine closest threat and closest source of food
-        for agent in self.model.grid.iter_cell_list_contents(visible):
-            if isinstance(agent, Organism) and Organism.can_eat(agent, self):
-                if not closest_threat or squared_distance(self.pos, closest_threat.pos) < squared_distance(self.pos, agent.pos):
-                    closest_threat = agent
-            elif isinstance(agent, Food):
-                if not closest_food or squared_distance(self.pos, closest_food.pos) < squared_distance(self.pos, agent.pos):
-                    closest_food = agent
+        closest_threat = grid.select(Organism, self.pos, self.awareness,
+            lambda agent: Organism.can_eat(agent, self))
+        closest_food = grid.select(Food, self.pos, self.awareness)
 
         if self.trail:
-            for agent in self.model.grid.iter_cell_list_contents([self.pos]):
-                if isinstance(agent, PheromoneTrail) and agent.creator != self.unique_id:
-                    if (not strongest_trail or agent.strength > strongest_trail.strength) and agent.came_from != self.pos:
-                        strongest_trail = agent
+            trail = self.model.trails.get(self.pos)
+            if trail is not None and trail.creator != self.unique_id and trail.came_from != self.pos:
+                trail_strength, trail_came_from = trail.strength, trail.came_from
 
         if closest_threat:
             for pos in adjacent:
@@ -108,8 +169,8 @@ class Organism(Agent):
             for pos in adjacent:
                 if not next_pos or squared_distance(pos, closest_food.pos) < squared_distance(next_pos, closest_food.pos):
                     next_pos = pos
-        elif strongest_trail and self.random.random() <= strongest_trail.strength / PheromoneTrail.MAX_STRENGTH:
-            next_pos = strongest_trail.came_from
+        elif trail_strength and self.random.random() <= trail_strength / PheromoneTrail.MAX_STRENGTH:
+            next_pos = trail_came_from
         else:
             next_pos = self.random.choice(adjacent)
 
@@ -120,13 +181,16 @@ class Organism(Agent):
             came_from = self.pos
             self.model.grid.move_agent(self, next_pos)
             if self.trail_length > 0:
-                trail = PheromoneTrail(self.model, self.unique_id, came_from, Organism.MAX_TRAIL_LENGTH - self.trail_length)
-                self.model.schedule.add(trail)
-                self.model.grid.place_agent(trail, self.pos)
+                self.model.trails.leave(self.pos, self.unique_id, came_from, Organism.MAX_TRAIL_LENGTH - self.trail_length)
                 self.trail_length -= 1
 
     def move_energy(self, distance_moved: float) -> float:
-        return 0.35 * pow(self.size, 3) * pow(self.speed, 2) * distance_moved + 0.4 * self.awareness
+        return Organism.energy_cost(self.size, self.speed, self.awareness, distance_moved)
+
+    @staticmethod
+    def energy_cost(size, speed, awareness, distance_moved):
+        # Also used with NumPy arrays by the array engine
+        return 0.35 * pow(size, 3) * pow(speed, 2) * distance_moved + 0.4 * awareness
 
     @staticmethod
     def can_eat(organism1, organism2) -> bool:
@@ -146,6 +210,7 @@ class Organism(Agent):
         if self.prob_replication < 1.0:
             self.eat(amount)
             food.amount -= amount
+            self.model.grid.touch(food.pos)
             if food.amount <= 0:
                 self.model.agents_to_remove.add(food)
 
@@ -155,11 +220,10 @@ class Organism(Agent):
             self.eat(1.0)
             self.model.agents_to_remove.add(organism)
             self.model.num_organisms -= 1
+            if self.model.lineage is not None:
+                self.model.lineage.death(organism, self.model.generation, self)
 
-    def step(self):
-        if self in self.model.agents_to_remove:
-            return
-
+    def eat_in_cell(self):
         cell_contents = self.model.grid.get_cell_list_contents([self.pos])
         if len(cell_contents) > 1:
             # Agent is not alone in cell
@@ -173,6 +237,8 @@ class Organism(Agent):
                     if self.trail:
                         amount = min(0.5, other.amount)
                         if other.amount > 0.5:
+                            if self.food_positions is NO_FOOD_POSITIONS:
+                                self.food_positions = set()
                             self.food_positions.add(other.pos)
                             self.trail_length = Organism.MAX_TRAIL_LENGTH
                     self.eat_food(other, amount)
@@ -181,11 +247,6 @@ class Organism(Agent):
                     if self.size > other.size: # If agent is bigger than other, eat it
                         self.eat_organism(other)
 
-        self.move_ticks -= 1
-        if self.move_ticks == 0:
-            self.move()
-            self.reset_move_ticks()
-
     def replicate(self):
         speed = self.speed
         awareness = self.awareness
@@ -207,10 +268,27 @@ class Organism(Agent):
             size += 2 * Organism.MAX_SIZE_MUTATION * self.model.random.random() - Organism.MAX_SIZE_MUTATION
             size = clamp(size, Organism.MIN_SIZE, Organism.MAX_SIZE)
 
-        return Organism(self.model, speed, awareness, size, self.trail)
+        return self.model.new_organism(speed, awareness, size, self.trail)
+
+def create_data_collectors(model: Model) -> List[DataCollector]:
+    # Per-generation results of a model (also of a ReplayModel): number of organisms, average
+    # genes, trail percentage and average age
+    return [
+        DataCollector(model_reporters={'Organisms': 'num_organisms'}),
+        DataCollector(
+            model_reporters={
+                'Speed': lambda m: m.property_average('speed'),
+                'Awareness': lambda m: m.property_average('awareness'),
+                'Size': lambda m: m.property_average('size')
+            }
+        ),
+        DataCollector(model_reporters={'Trail Percentage': lambda m: m.trail_percentage()}),
+        DataCollector(model_reporters={'Age': lambda m: m.property_average('age')}),
+    ]
 
 class NSModel(Model):
     STEPS_PER_GENERATION = 120
+    ENGINES = ('agents', 'array')
 
     def __init__(
             self,
@@ -218,91 +296,177 @@ class NSModel(Model):
             food_per_generation: int = 60, speed_mutation_rate: float = 0.08,
             awareness_mutation_rate: float = 0.08, size_mutation_rate: float = 0.08,
             initial_speed: int = 3, initial_awareness: int = 2,
-            initial_size: float = 1.0, initial_trail: float = 0.5
+            initial_size: float = 1.0, initial_trail: float = 0.5, engine: str = 'agents',
+            replicates: int = 1, sparse: bool = False, tiles: int = 1
         ) -> None:
         super().__init__()
 
+        if engine not in NSModel.ENGINES:
+            raise ValueError(f'unknown engine: {engine}')
+        if replicates != 1 and engine != 'array':
+            raise ValueError('replicates can only be run in lockstep by the array engine')
+        if sparse and engine == 'array':
+            raise ValueError('the array engine has no sparse grid')
+        if tiles < 1:
+            raise ValueError('there must be at least one tile')
+        if tiles != 1 and engine != 'agents':
+            raise ValueError('only the agent engine can be split into tiles')
+        if tiles != 1 and width // tiles < max(1, Organism.MAX_AWARENESS):
+            raise ValueError(f'tiles must be at least {max(1, Organism.MAX_AWARENESS)} cells wide')
+
+        self.parameters = {
+            'seed': seed, 'num_organisms': num_organisms, 'width': width, 'height': height,
+            'food_per_generation': food_per_generation,
+            'speed_mutation_rate': speed_mutation_rate,
+            'awareness_mutation_rate': awareness_mutation_rate,
+            'size_mutation_rate': size_mutation_rate,
+            'initial_speed': initial_speed, 'initial_awareness': initial_awareness,
+            'initial_size': initial_size, 'initial_trail': initial_trail, 'engine': engine,
+            'replicates': replicates, 'sparse': sparse, 'tiles': tiles
+        }
+
+        self.width = width
+        self.height = height
         self.num_organisms = num_organisms
-        self.grid = MultiGrid(width, height, torus=False)
         self.food_per_generation = food_per_generation
 
         self.speed_mutation_rate = speed_mutation_rate
         self.awareness_mutation_rate = awareness_mutation_rate
         self.size_mutation_rate = size_mutation_rate
 
-        self.schedule = RandomActivation(self)
+        self.schedule = MoveScheduler(self, Organism, 1 + Organism.MAX_SPEED - Organism.MIN_SPEED)
         self.agents_to_remove = set()
 
-        self.border_cells = (
-            {(0, y) for y in range(self.grid.height)} |
-            {(x, 0) for x in range(self.grid.width)} |
-            {(self.grid.width - 1, y) for y in range(self.grid.height)} |
-            {(x, self.grid.height - 1) for x in range(self.grid.width)}
-        )
-        self.center_cells = (
-            {(x, y) for x in range(self.grid.width) for y in range(self.grid.height)} -
-            self.border_cells
-        )
-
         self.generation = 1
         self.step_count = 0
 
-        # Create agents
-        for i in range(num_organisms):
-            trail = i < num_organisms * initial_trail
-            agent = Organism(self, initial_speed, initial_awareness, initial_size, trail)
-            self.schedule.add(agent)
+        self.engine = engine
+        self.arrays = None
+        self.tiles = None
+
+        # Set with enable_checkpoints
+        self.checkpoint_path = None
+        self.checkpoint_interval = 0
+
+        # Set with attach_sink
+        self.metrics_sink = None
+        self.metrics_position = None
+        self.keep_history = True
+
+        # Set with enable_profiling
+        self.profiler = None
+
+        # Set with enable_recording (the position is set by load_checkpoint)
+        self.recorder = None
+        self.recording_position = None
+
+        # Set with enable_termination
+        self.termination = None
+
+        # Set with enable_lineage (the position is set by load_checkpoint)
+        self.lineage = None
+        self.lineage_position = None
+
+        # Agents removed from the model, reused by new_organism and new_food so that steady
+        # generations allocate almost no agents
+        self.organism_pool: List[Organism] = []
+        self.food_pool: List[Food] = []
+
+        if engine == 'array':
+            # Imported here so that NumPy is only loaded when the array engine is used
+            from vectorized import ArrayEngine
+            self.arrays = ArrayEngine(self, width, height, num_organisms, initial_speed,
+                initial_awareness, initial_size, initial_trail, replicates)
+            self.num_organisms = len(self.arrays)
+        elif tiles != 1:
+            # Imported here so that worker processes are only set up when tiles are used
+            from tiling import TiledEngine
+            self.tiles = TiledEngine(self, tiles, initial_speed, initial_awareness, initial_size,
+                initial_trail)
+        else:
+            if sparse:
+                self.grid = SparseGrid(width, height, (Food, Organism))
+            else:
+                self.grid = IndexedGrid(width, height, (Food, Organism))
+            self.trails = TrailField()
+            self.stats = PopulationStats(('speed', 'awareness', 'size', 'age', 'trail'))
 
-        self.place_agents(init=True)
-        self.place_food()
+            # Create agents
+            for i in range(num_organisms):
+                trail = i < num_organisms * initial_trail
+                agent = Organism(self, initial_speed, initial_awareness, initial_size, trail)
+                self.schedule.add(agent)
+                self.stats.add(agent)
+
+            self.place_agents()
+            self.place_food()
 
         # Initialize data collectors
-        self.dc_num_organisms = DataCollector(
-            model_reporters={'Organisms': 'num_organisms'}
-        )
-        self.dc_properties = DataCollector(
-            model_reporters={
-                'Speed': lambda _: self.property_average('speed'),
-                'Awareness': lambda _: self.property_average('awareness'),
-                'Size': lambda _: self.property_average('size')
-            }
-        )
-        self.dc_trail_percentage = DataCollector(
-            model_reporters={'Trail Percentage': self.trail_percentage}
-        )
-        self.dc_age = DataCollector(
-            model_reporters={'Age': lambda _: self.property_average('age')}
-        )
-
-        self.data_collectors = [self.dc_num_organisms, self.dc_properties,
-            self.dc_trail_percentage, self.dc_age]
+        self.data_collectors = create_data_collectors(self)
+        self.dc_num_organisms, self.dc_properties, self.dc_trail_percentage, self.dc_age = \
+            self.data_collectors
         self.update_data_collectors()
 
     def remove_agent(self, agent: Agent):
         self.grid.remove_agent(agent)
         self.schedule.remove(agent)
-
-    def place_agents(self, init=False):
-        if len(self.border_cells) >= len(self.schedule.agents):
-            positions = self.random.sample(self.border_cells, len(self.schedule.agents))
+        if isinstance(agent, Organism):
+            self.stats.remove(agent)
+            self.organism_pool.append(agent)
         else:
-            positions = self.random.choices(list(self.border_cells), k=len(self.schedule.agents))
+            self.food_pool.append(agent)
+
+    def new_organism(self, speed: int, awareness: int, size: float, trail: bool) -> Organism:
+        if self.organism_pool:
+            organism = self.organism_pool.pop()
+            organism.recycle(speed, awareness, size, trail)
+            return organism
+        return Organism(self, speed, awareness, size, trail)
+
+    def new_food(self) -> Food:
+        if self.food_pool:
+            food = self.food_pool.pop()
+            food.recycle()
+            return food
+        return Food(self)
+
+    def organisms(self):
+        return (agent for agent in self.schedule.agents if isinstance(agent, Organism))
+
+    def border_sample(self, k: int) -> List[Tuple[int, int]]:
+        # Border and center cells are sampled by number, so that they are never listed.
+        # Border cells are only sampled with replacement when there are more than k.
+        width, height = self.width, self.height
+        cells = range(border_size(width, height))
+        if len(cells) >= k:
+            numbers = self.random.sample(cells, k)
+        else:
+            numbers = self.random.choices(cells, k=k)
+        return [border_position(i, width, height) for i in numbers]
 
-        for i, agent in enumerate(self.schedule.agents):
-            if init:
-                self.grid.place_agent(agent, positions[i])
-            else:
-                self.grid.move_agent(agent, positions[i])
+    def center_sample(self, k: int) -> List[Tuple[int, int]]:
+        width, height = self.width, self.height
+        numbers = self.random.sample(range(center_size(width, height)), k)
+        return [center_position(i, width, height) for i in numbers]
+
+    def place_agents(self):
+        agents = self.schedule.agents
+        self.grid.place_agents(agents, self.border_sample(len(agents)))
 
     def place_food(self):
-        cells = self.random.sample(self.center_cells, self.food_per_generation)
+        cells = self.center_sample(self.food_per_generation)
 
-        for i in range(self.food_per_generation):
-            food = Food(self)
-            self.schedule.add(food)
-            self.grid.place_agent(food, cells[i])
+        food = [self.new_food() for _ in range(self.food_per_generation)]
+        for agent in food:
+            self.schedule.add(agent)
+        self.grid.place_agents(food, cells)
 
     def property_average(self, prop_name: str) -> float:
+        if self.arrays is not None:
+            return self.arrays.property_average(prop_name)
+        if self.stats.tracks(prop_name):
+            return self.stats.average(prop_name)
+
         acc, count = 0, 0
         for agent in self.schedule.agents:
             if isinstance(agent, Organism):
@@ -311,52 +475,202 @@ class NSModel(Model):
         return acc / count if count != 0 else 0.0
 
     def trail_percentage(self) -> float:
-        acc, count = 0, 0
-        for agent in self.schedule.agents:
-            if isinstance(agent, Organism):
-                acc += int(agent.trail)
-                count += 1
-        return 100 * acc / count if count != 0 else 0.0
+        if self.arrays is not None:
+            return self.arrays.trail_percentage()
+        count = self.stats.count
+        return 100 * self.stats.sums['trail'] / count if count != 0 else 0.0
+
+    def latest_record(self) -> Dict[str, Any]:
+        record = {'Generation': self.generation}
+        for dc in self.data_collectors:
+            for name, values in dc.model_vars.items():
+                record[name] = values[-1]
+        return record
+
+    def trim_history(self):
+        # Only the latest value is kept (the charts only ever show the latest value)
+        for dc in self.data_collectors:
+            for values in dc.model_vars.values():
+                del values[:-1]
+
+    def attach_sink(self, sink, keep_history: bool = True, write_current: bool = True):
+        self.metrics_sink = sink
+        self.keep_history = keep_history
+
+        if write_current:
+            sink.write(self.latest_record())
+        if not keep_history:
+            self.trim_history()
 
     def update_data_collectors(self):
         for dc in self.data_collectors:
             dc.collect(self)
 
+        if self.metrics_sink is not None:
+            self.metrics_sink.write(self.latest_record())
+            if not self.keep_history:
+                self.trim_history()
+
     def new_generation(self):
+        if self.arrays is not None:
+            self.arrays.new_generation()
+        elif self.tiles is not None:
+            self.tiles.new_generation()
+        else:
+            self.new_agent_generation()
+
+        self.generation += 1
+        with self.phase('data_collection'):
+            self.update_data_collectors()
+
+        if self.termination is not None and self.termination.check(self):
+            self.running = False
+
+        if self.checkpoint_path and self.generation % self.checkpoint_interval == 0:
+            from checkpoint import save_checkpoint
+            with self.phase('checkpoint'):
+                if self.metrics_sink is not None:
+                    self.metrics_sink.flush()
+                save_checkpoint(self, self.checkpoint_path)
+
+        if self.profiler is not None:
+            self.profiler.dump(self.generation)
+
+    def enable_recording(self, path: str):
+        # Records the current state and every tick from now on (see recording.py). A model
+        # loaded from a checkpoint appends to the recording of the run it was taken from.
+        if self.arrays is not None or self.tiles is not None:
+            raise ValueError('only models run by the agent engine in one process can be recorded')
+
+        from recording import TrajectoryRecorder
+        self.recorder = TrajectoryRecorder(path, self.parameters, self.recording_position)
+        self.recorder.record(self)
+
+    def enable_termination(self, **criteria) -> Termination:
+        # Stops the run (running is set to False) when any of the criteria is met
+        self.termination = Termination(**criteria)
+        return self.termination
+
+    def enable_lineage(self, path: str):
+        # Logs the current organisms as founders, then every birth and death (see lineage.py).
+        # A model loaded from a checkpoint appends to the log of the run it was taken from.
+        if self.arrays is not None or self.tiles is not None:
+            raise ValueError('only lineages of the agent engine in one process can be logged')
+
+        from lineage import LineageRecorder
+        self.lineage = LineageRecorder(path, self.lineage_position)
+        if not self.lineage.resumed:
+            self.lineage.founders(self.organisms(), self.generation)
+
+    def close(self):
+        # Stops the worker processes of a model split into tiles and finishes the recording and
+        # the lineage log
+        if self.tiles is not None:
+            self.tiles.close()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self.lineage is not None:
+            self.lineage.close()
+            self.lineage = None
+
+    def phase(self, name: str):
+        return self.profiler.phase(name) if self.profiler is not None else NO_PHASE
+
+    def enable_profiling(self, dump_path: str = None) -> PhaseProfiler:
+        # Tiles are stepped by worker processes, where nothing would be timed
+        if self.tiles is not None:
+            raise ValueError('models split into tiles cannot be profiled')
+        self.profiler = PhaseProfiler(dump_path)
+        return self.profiler
+
+    def enable_checkpoints(self, path: str, interval: int = 10):
+        if self.tiles is not None:
+            raise ValueError('models split into tiles cannot be checkpointed')
+        if interval < 1:
+            raise ValueError('checkpoints must be at least one generation apart')
+        self.checkpoint_path = path
+        self.checkpoint_interval = interval
+
+    def new_agent_generation(self):
+        occupied = [agent.pos for agent in self.schedule.agents]
+
+        # Survival and replication of the whole population, then the next population
+        with self.phase('generation:survival'):
+            survivors, replicas = self.select_survivors()
+
+        # The grid and schedule are rebuilt with the next population at once
+        with self.phase('generation:placement'):
+            self.grid.clear_cells(occupied)
+            self.schedule.replace(survivors + replicas)
+            self.trails.clear()
+            self.place_agents()
+            self.place_food()
+
+    def select_survivors(self) -> Tuple[List[Organism], List[Organism]]:
+        # Organisms that survive the generation, and their replicas. Dead organisms and food
+        # go back to the pools, but are left on the grid and in the schedule.
+        survivors, replicas = [], []
+
         for agent in self.schedule.agents:
             if isinstance(agent, Organism):
                 survives = self.random.random() <= agent.prob_survival
                 replicates = self.random.random() <= agent.prob_replication
 
                 if not survives:
-                    self.remove_agent(agent)
+                    self.stats.remove(agent)
+                    self.organism_pool.append(agent)
                     self.num_organisms -= 1
+                    if self.lineage is not None:
+                        self.lineage.death(agent, self.generation)
                 else:
                     agent.age += 1
+                    self.stats.update(agent, 'age', agent.age - 1)
+                    agent.reset()
+                    survivors.append(agent)
+
                     if replicates:
                         replica = agent.replicate()
-                        self.schedule.add(replica)
-                        self.grid.place_agent(replica, (0, 0))
+                        self.stats.add(replica)
+                        replicas.append(replica)
                         self.num_organisms += 1
-
-                agent.reset()
+                        if self.lineage is not None:
+                            self.lineage.birth(replica, agent, self.generation + 1)
             else:
-                self.remove_agent(agent)
+                self.food_pool.append(agent)
 
-        self.place_agents()
-        self.place_food()
-        self.generation += 1
+        return survivors, replicas
 
-        self.update_data_collectors()
+    def step_agents(self):
+        # Trails decay at the start of the tick after the one they were left in
+        with self.phase('trail_decay'):
+            self.trails.decay()
 
-    def step(self):
-        self.schedule.step()
+        with self.phase('schedule'):
+            if self.profiler is not None:
+                self.profiler.step_schedule(self.schedule)
+            else:
+                self.schedule.step()
+
+        with self.phase('removals'):
+            # In a fixed order, so that population sums are added up the same way every run
+            for agent in sorted(self.agents_to_remove, key=attrgetter('unique_id')):
+                self.remove_agent(agent)
+            self.agents_to_remove.clear()
 
-        for agent in self.agents_to_remove:
-            self.remove_agent(agent)
-        self.agents_to_remove.clear()
+    def step(self):
+        if self.arrays is not None:
+            self.arrays.step()
+        elif self.tiles is not None:
+            self.tiles.step()
+        else:
+            self.step_agents()
 
         self.step_count = (self.step_count + 1) % NSModel.STEPS_PER_GENERATION
 
         if self.step_count == 0:
             self.new_generation()
+
+        if self.recorder is not None:
+            with self.phase('recording'):
+                self.recorder.record(self)
@@ -0,0 +1,75 @@
+import json
+from collections import defaultdict
+from contextlib import nullcontext
+from time import perf_counter
+from typing import Any, Dict
+
+from scheduling import MoveScheduler
+
+# Cumulative wall time and number of calls of each phase of the simulation. Models only time
+# their phases while a profiler is attached to them.
+class PhaseProfiler:
+    def __init__(self, dump_path: str = None) -> None:
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.step_phases: Dict[type, str] = {}
+        self.dump_file = open(dump_path, 'w') if dump_path else None
+
+    def phase(self, name: str) -> 'Phase':
+        return Phase(self, name)
+
+    def record(self, name: str, seconds: float):
+        self.seconds[name] += seconds
+        self.calls[name] += 1
+
+    def step_schedule(self, schedule: MoveScheduler):
+        # Same as MoveScheduler.step, but each activation is timed by agent type
+        for agent in schedule.activations():
+            phase = self.step_phases.get(type(agent))
+            if phase is None:
+                phase = self.step_phases[type(agent)] = f'step:{type(agent).__name__}'
+
+            start = perf_counter()
+            schedule.activate(agent)
+            self.record(phase, perf_counter() - start)
+
+        schedule.advance()
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {
+                'seconds': self.seconds[name],
+                'calls': self.calls[name],
+                'mean': self.seconds[name] / self.calls[name],
+            }
+            for name in sorted(self.seconds, key=self.seconds.get, reverse=True)
+        }
+
+    def dump(self, generation: int):
+        if self.dump_file is not None:
+            self.dump_file.write(json.dumps({'generation': generation, 'phases': self.report()}) + '\n')
+            self.dump_file.flush()
+
+    def reset(self):
+        self.seconds.clear()
+        self.calls.clear()
+
+    def close(self):
+        if self.dump_file is not None:
+            self.dump_file.close()
+
+class Phase:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler: PhaseProfiler, name: str) -> None:
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *_):
+        self.profiler.record(self.name, perf_counter() - self.start)
+
+# Used in place of a phase while profiling is disabled
+NO_PHASE = nullcontext()
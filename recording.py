@@ -0,0 +1,274 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from operator import attrgetter
+from typing import Any, Dict, List, Optional, Tuple
+
+from mesa import Model
+from mesa.time import BaseScheduler
+
+from model import Food, Organism, PheromoneTrail, TrailField, create_data_collectors
+from stats import PopulationStats
+
+MAGIC = b'NSTR1'
+
+# Trajectories are recorded as one block per tick (after every step, and the initial state),
+# appended to the file as the run goes. Each block has a header with its size, generation, tick
+# and the number of organisms, food and trails, followed by a column for each of their values.
+# Columns are padded to 8 bytes and read in place from a memory map. The first block of each
+# generation is listed in an index file next to the recording (path + '.idx'), so generations
+# are found without reading the blocks before them.
+
+def position(i: int):
+    return lambda agent: agent.pos[i]
+
+ORGANISM_COLUMNS = (
+    ('unique_id', 'q', attrgetter('unique_id')),
+    ('x', 'i', position(0)),
+    ('y', 'i', position(1)),
+    ('speed', 'b', attrgetter('speed')),
+    ('awareness', 'b', attrgetter('awareness')),
+    ('size', 'f', attrgetter('size')),
+    ('trail', 'b', attrgetter('trail')),
+    ('age', 'i', attrgetter('age')),
+    ('energy', 'f', attrgetter('energy')),
+    ('prob_survival', 'f', attrgetter('prob_survival')),
+    ('prob_replication', 'f', attrgetter('prob_replication')),
+)
+FOOD_COLUMNS = (
+    ('unique_id', 'q', attrgetter('unique_id')),
+    ('x', 'i', position(0)),
+    ('y', 'i', position(1)),
+    ('amount', 'f', attrgetter('amount')),
+)
+TRAIL_COLUMNS = (
+    ('x', 'i', position(0)),
+    ('y', 'i', position(1)),
+    ('from_x', 'i', lambda trail: trail.came_from[0]),
+    ('from_y', 'i', lambda trail: trail.came_from[1]),
+    ('strength', 'b', attrgetter('strength')),
+    ('creator', 'q', attrgetter('creator')),
+)
+
+# Magic, whether the file is big endian and the length of the model parameters (JSON)
+HEADER = struct.Struct('=5s?I')
+# Size, generation, tick and number of organisms, food and trails
+BLOCK = struct.Struct('=qiiiii')
+# Generation and offset of its first block
+INDEX_ENTRY = struct.Struct('=qq')
+
+def padded(size: int) -> int:
+    return (size + 7) & ~7
+
+def index_path(path: str) -> str:
+    return path + '.idx'
+
+class TrajectoryRecorder:
+    def __init__(self, path: str, parameters: Dict[str, Any],
+            position: Tuple[int, int] = None) -> None:
+        self.path = path
+
+        # A run resumed from a checkpoint appends to its recording, from where it was when the
+        # checkpoint was taken (ticks recorded after it are recorded again)
+        if position is not None and os.path.exists(path) and os.path.exists(index_path(path)):
+            self.offset, index_size = position
+            os.truncate(path, self.offset)
+            os.truncate(index_path(path), index_size)
+            self.file = open(path, 'ab')
+            self.index = open(index_path(path), 'ab')
+            return
+
+        self.file = open(path, 'wb')
+        self.index = open(index_path(path), 'wb')
+
+        params = json.dumps(parameters).encode()
+        header = HEADER.pack(MAGIC, sys.byteorder == 'big', len(params)) + params
+        self.file.write(header.ljust(padded(len(header)), b'\0'))
+        self.offset = self.file.tell()
+
+    def record(self, model):
+        organisms = [agent for agent in model.schedule.agents if isinstance(agent, Organism)]
+        food = [agent for agent in model.schedule.agents if isinstance(agent, Food)]
+        trails = list(model.trails.trails())
+
+        columns = []
+        for agents, specs in ((organisms, ORGANISM_COLUMNS), (food, FOOD_COLUMNS),
+                (trails, TRAIL_COLUMNS)):
+            for _, typecode, value in specs:
+                data = array(typecode, map(value, agents)).tobytes()
+                columns.append(data.ljust(padded(len(data)), b'\0'))
+
+        size = padded(BLOCK.size) + sum(map(len, columns))
+        header = BLOCK.pack(size, model.generation, model.step_count, len(organisms), len(food),
+            len(trails))
+
+        if model.step_count == 0:
+            self.index.write(INDEX_ENTRY.pack(model.generation, self.offset))
+        self.file.write(header.ljust(padded(BLOCK.size), b'\0'))
+        for data in columns:
+            self.file.write(data)
+        self.offset += size
+
+    def position(self) -> Tuple[int, int]:
+        # Size of the recording and of its index after a flush
+        self.file.flush()
+        self.index.flush()
+        return self.offset, self.index.tell()
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+# Columns of a single tick, read from the memory map without copying them
+class Frame:
+    def __init__(self, view: memoryview, offset: int) -> None:
+        self.size, self.generation, self.step_count, organisms, food, trails = \
+            BLOCK.unpack_from(view, offset)
+
+        offset += padded(BLOCK.size)
+        self.columns: Dict[str, Dict[str, memoryview]] = {}
+        for kind, count, specs in (('organisms', organisms, ORGANISM_COLUMNS),
+                ('food', food, FOOD_COLUMNS), ('trails', trails, TRAIL_COLUMNS)):
+            columns = self.columns[kind] = {}
+            for name, typecode, _ in specs:
+                size = count * array(typecode).itemsize
+                columns[name] = view[offset:offset + size].cast(typecode)
+                offset += padded(size)
+
+    def rows(self, kind: str) -> List[Tuple]:
+        return list(zip(*self.columns[kind].values()))
+
+class TrajectoryReader:
+    def __init__(self, path: str) -> None:
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+        magic, big_endian, params_size = HEADER.unpack_from(self.view, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a trajectory recording')
+        if big_endian != (sys.byteorder == 'big'):
+            raise ValueError(f'{path} was recorded on a machine with a different byte order')
+        self.parameters = json.loads(bytes(self.view[HEADER.size:HEADER.size + params_size]))
+
+        # Only blocks that were completely written are read, in case the run was interrupted
+        with open(index_path(path), 'rb') as index:
+            entries = list(INDEX_ENTRY.iter_unpack(index.read()))
+        self.starts: Dict[int, int] = {
+            generation: offset for generation, offset in entries if self.complete(offset)
+        }
+
+    def complete(self, offset: int) -> bool:
+        if offset + BLOCK.size > len(self.map):
+            return False
+        return offset + BLOCK.unpack_from(self.view, offset)[0] <= len(self.map)
+
+    def generations(self) -> int:
+        return max(self.starts, default=0)
+
+    def frame(self, offset: int) -> Frame:
+        return Frame(self.view, offset)
+
+    def next_offset(self, frame: Frame, offset: int) -> Optional[int]:
+        offset += frame.size
+        return offset if self.complete(offset) else None
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+# Model that plays a recording back, starting from the given generation, for the visualization
+# elements of the server. Agents and trails are rebuilt from each frame, and the collected data
+# of the generations up to the start is computed from their first frames.
+class ReplayModel(Model):
+    def __init__(self, path: str, generation: int = 1) -> None:
+        super().__init__()
+        self.reader = TrajectoryReader(path)
+        self.parameters = self.reader.parameters
+
+        self.schedule = BaseScheduler(self)
+        self.trails = TrailField()
+        self.stats = PopulationStats(('speed', 'awareness', 'size', 'age', 'trail'))
+        self.num_organisms = 0
+        self.generation = 1
+        self.step_count = 0
+
+        self.organism_pool: List[Organism] = []
+        self.food_pool: List[Food] = []
+
+        self.data_collectors = create_data_collectors(self)
+        self.dc_num_organisms, self.dc_properties, self.dc_trail_percentage, self.dc_age = \
+            self.data_collectors
+
+        if not self.reader.starts:
+            raise ValueError(f'{path} has no recorded generations')
+
+        # Recordings of resumed runs start at the generation they were resumed from. Sliders
+        # may send the generation as a float.
+        first = min(self.reader.starts)
+        generation = min(max(first, int(generation)), self.reader.generations())
+        for g in range(first, generation + 1):
+            if g in self.reader.starts:
+                self.offset = self.reader.starts[g]
+                self.load(self.reader.frame(self.offset))
+                self.update_data_collectors()
+
+    def load(self, frame: Frame):
+        self.generation = frame.generation
+        self.step_count = frame.step_count
+
+        self.schedule = BaseScheduler(self)
+        self.stats = PopulationStats(('speed', 'awareness', 'size', 'age', 'trail'))
+
+        organisms = frame.rows('organisms')
+        while len(self.organism_pool) < len(organisms):
+            self.organism_pool.append(Organism(self))
+        for organism, row in zip(self.organism_pool, organisms):
+            (organism.unique_id, x, y, organism.speed, organism.awareness, organism.size,
+                trail, organism.age, organism.energy, organism.prob_survival,
+                organism.prob_replication) = row
+            organism.pos = (x, y)
+            organism.trail = bool(trail)
+            self.schedule.add(organism)
+            self.stats.add(organism)
+        self.num_organisms = len(organisms)
+
+        food = frame.rows('food')
+        while len(self.food_pool) < len(food):
+            self.food_pool.append(Food(self))
+        for agent, (unique_id, x, y, amount) in zip(self.food_pool, food):
+            agent.unique_id, agent.pos, agent.amount = unique_id, (x, y), amount
+            self.schedule.add(agent)
+
+        self.trails.clear()
+        for x, y, from_x, from_y, strength, creator in frame.rows('trails'):
+            self.trails.cells[(x, y)] = PheromoneTrail((x, y), creator, (from_x, from_y), strength)
+
+    def organisms(self):
+        return (agent for agent in self.schedule.agents if isinstance(agent, Organism))
+
+    def property_average(self, prop_name: str) -> float:
+        return self.stats.average(prop_name)
+
+    def trail_percentage(self) -> float:
+        count = self.stats.count
+        return 100 * self.stats.sums['trail'] / count if count != 0 else 0.0
+
+    def update_data_collectors(self):
+        for dc in self.data_collectors:
+            dc.collect(self)
+
+    def step(self):
+        offset = self.reader.next_offset(self.reader.frame(self.offset), self.offset)
+        if offset is None:
+            self.running = False
+            return
+
+        self.offset = offset
+        self.load(self.reader.frame(offset))
+        if self.step_count == 0:
+            self.update_data_collectors()
@@ -1,8 +1,8 @@
 
 from argparse import ArgumentParser, HelpFormatter
 
-from model import Organism
-from server import create_server
+from headless import add_termination_arguments, run_headless, termination_criteria
+from model import NSModel, Organism
 
 def main():
     def formatter(prog):
@@ -39,13 +39,102 @@ def main():
     parser.add_argument('-it', '--initial-trail', metavar='T', type=float, default=0.5,
         help='ratio of initial population with trail gene')
 
+    parser.add_argument('--background', action='store_true',
+        help='run the model continuously in the server, sampling frames for the browser')
+    parser.add_argument('--sampling', choices=('frame', 'generation'), default='generation',
+        help='when frames are sampled in background mode: on every frame the browser asks for, '
+            'or once per generation')
+    parser.add_argument('--headless', action='store_true',
+        help='run the simulation without the visualization server')
+    parser.add_argument('--engine', choices=NSModel.ENGINES, default='agents',
+        help='simulation engine (the array engine only supports headless mode)')
+    parser.add_argument('--sparse', action='store_true',
+        help='only store the occupied cells of the grid, for very large and mostly empty worlds')
+    parser.add_argument('--tiles', metavar='T', type=int, default=1,
+        help='split the world into T vertical strips, each stepped by a worker process '
+            '(headless mode only)')
+    parser.add_argument('-g', '--generations', metavar='G', type=int, default=100,
+        help='number of generations to simulate in headless mode')
+    parser.add_argument('-o', '--output', metavar='O', default='results.csv',
+        help='file to write collected data to in headless mode (.csv, .jsonl, .arrow or .parquet)')
+    parser.add_argument('--batch-size', metavar='B', type=int, default=100,
+        help='number of generations to buffer before writing them to the output')
+    parser.add_argument('--profile', metavar='P', default=None,
+        help='time each phase of the simulation and write the totals to P every generation')
+    parser.add_argument('--checkpoint', metavar='C', default=None,
+        help='file to save checkpoints to in headless mode')
+    parser.add_argument('--checkpoint-every', metavar='K', type=int, default=10,
+        help='number of generations between checkpoints')
+    parser.add_argument('--resume', metavar='C', default=None,
+        help='checkpoint to resume a headless run from (model arguments are ignored)')
+    parser.add_argument('--record', metavar='R', default=None,
+        help='record every tick of a headless run to R, to be played back with --replay')
+    parser.add_argument('--replay', metavar='R', default=None,
+        help='play a recording back in the visualization server (model arguments are ignored)')
+    parser.add_argument('--lineage', metavar='L', default=None,
+        help='log every birth and death of a headless run to L, for ancestry queries with '
+            'lineage.py')
+    add_termination_arguments(parser)
+
     args = vars(parser.parse_args())
 
+    if args['engine'] == 'array' and not args['headless']:
+        parser.error('the array engine can only be used in headless mode')
+    if args['engine'] == 'array' and args['sparse']:
+        parser.error('the array engine has no sparse grid')
+    if args['checkpoint_every'] < 1:
+        parser.error('checkpoints must be at least one generation apart')
+    if args['tiles'] != 1:
+        if args['engine'] != 'agents' or not args['headless']:
+            parser.error('only headless runs of the agent engine can be split into tiles')
+        if args['checkpoint'] or args['resume']:
+            parser.error('runs split into tiles cannot be checkpointed')
+        if args['profile']:
+            parser.error('runs split into tiles cannot be profiled')
+    if args['record'] and (args['engine'] != 'agents' or args['tiles'] != 1 or not args['headless']):
+        parser.error('only headless runs of the agent engine in one process can be recorded')
+    if args['lineage'] and (args['engine'] != 'agents' or args['tiles'] != 1 or not args['headless']):
+        parser.error('only lineages of headless runs of the agent engine in one process can be '
+            'logged')
+    if args['replay'] and args['headless']:
+        parser.error('recordings can only be played back in the visualization server')
+
+    termination = termination_criteria(args)
+    if termination and not args['headless']:
+        parser.error('only headless runs can be stopped early')
+
     Organism.MAX_ENERGY = args['energy']
     del args['energy']
 
-    server = create_server(args)
-    server.launch()
+    headless = args.pop('headless')
+    generations = args.pop('generations')
+    output = args.pop('output')
+    checkpoint = args.pop('checkpoint')
+    checkpoint_every = args.pop('checkpoint_every')
+    resume = args.pop('resume')
+    batch_size = args.pop('batch_size')
+    profile = args.pop('profile')
+    background = args.pop('background')
+    sampling = args.pop('sampling')
+    record = args.pop('record')
+    replay = args.pop('replay')
+    lineage = args.pop('lineage')
+
+    if headless:
+        run_headless(args, generations, output, checkpoint, checkpoint_every, resume,
+            batch_size, profile, record, termination, lineage)
+    else:
+        if replay:
+            # The visualization is set up for the model that was recorded
+            from recording import TrajectoryReader
+            reader = TrajectoryReader(replay)
+            args = reader.parameters
+            reader.close()
+
+        # The visualization stack is only loaded when the server is used
+        from server import create_server
+        server = create_server(args, background, sampling, replay)
+        server.launch()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,82 @@
+from operator import attrgetter
+from typing import Dict, Iterable, List, Type
+
+from mesa import Agent, Model
+from mesa.time import BaseScheduler
+
+# Scheduler that only activates the agents that have something to do in a tick: those that
+# move in it, kept in a timing wheel keyed on the tick of their next move, and those whose cell
+# changed since they last looked at it (the model's grid keeps a version number per cell).
+# Agents of other types (food) are scheduled but never activated. Activations within a tick
+# are in random order, and changes to a cell are seen by the agents activated after them in
+# the same tick and by the rest of the agents in the cell in the next tick.
+class MoveScheduler(BaseScheduler):
+    def __init__(self, model: Model, active_type: Type[Agent], max_interval: int) -> None:
+        super().__init__(model)
+        self.active_type = active_type
+        self.wheel: List[Dict[Agent, None]] = [{} for _ in range(max_interval + 1)]
+
+    def add(self, agent: Agent):
+        super().add(agent)
+        if isinstance(agent, self.active_type):
+            self.schedule_moves(agent)
+
+    def replace(self, agents: Iterable[Agent]):
+        # Schedules exactly the given agents, in their order
+        self._agents = {agent.unique_id: agent for agent in agents}
+        self.wheel = [{} for _ in self.wheel]
+        for agent in self._agents.values():
+            if isinstance(agent, self.active_type):
+                self.schedule_moves(agent)
+
+    def schedule_moves(self, agent: Agent):
+        if agent.next_move is None:
+            agent.next_move = self.time + agent.move_interval() - 1
+        agent.seen_version = -1
+        self.wheel[agent.next_move % len(self.wheel)][agent] = None
+
+    def remove(self, agent: Agent):
+        super().remove(agent)
+        if isinstance(agent, self.active_type):
+            self.wheel[agent.next_move % len(self.wheel)].pop(agent, None)
+
+    def activations(self) -> List[Agent]:
+        slot = self.time % len(self.wheel)
+        active = self.wheel[slot]
+        self.wheel[slot] = {}
+
+        grid = self.model.grid
+        changed, grid.changed = grid.changed, set()
+        buckets = grid.buckets[self.active_type]
+        for i in changed:
+            for agent in buckets[i]:
+                active[agent] = None
+
+        # Sorted first so that the order only depends on which agents are active
+        agents = sorted(active, key=attrgetter('unique_id'))
+        self.model.random.shuffle(agents)
+        return agents
+
+    def activate(self, agent: Agent):
+        if agent in self.model.agents_to_remove:
+            return
+
+        grid = self.model.grid
+        i = grid.index(agent.pos)
+        if agent.seen_version != grid.versions[i]:
+            agent.eat_in_cell()
+            agent.seen_version = grid.versions[i]
+
+        if agent.next_move == self.time:
+            agent.move()
+            agent.next_move = self.time + agent.move_interval()
+            self.wheel[agent.next_move % len(self.wheel)][agent] = None
+
+    def advance(self):
+        self.steps += 1
+        self.time += 1
+
+    def step(self):
+        for agent in self.activations():
+            self.activate(agent)
+        self.advance()
@@ -1,13 +1,12 @@
 
-import numpy as np
-from matplotlib.colors import to_hex
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, List, Tuple, Union
 
 from mesa import Agent, Model
-from mesa.visualization.modules import CanvasGrid
 from mesa.visualization.ModularVisualization import ModularServer
+from mesa.visualization.UserParam import Slider
 
-from visualization import GenerationChartModule, HistogramModule
+from background import BackgroundServer
+from visualization import GenerationChartModule, HistogramModule, DeltaCanvasGrid
 from model import Food, Organism, NSModel, PheromoneTrail
 
 def generation(model: Model) -> str:
@@ -30,7 +29,26 @@ def offset_to_coordinate(offset: Tuple[int, int]) -> str:
 
     return coord
 
-def agent_portrayal(agent: Agent):
+def to_hex(rgb: Tuple[float, float, float]) -> str:
+    # Same as matplotlib.colors.to_hex
+    return '#' + ''.join(f'{round(c * 255):02x}' for c in rgb)
+
+def organism_colors() -> List[List[str]]:
+    # Color of organisms by state (whether they have enough food to survive, to replicate, or
+    # neither, as the index of the brightened channel) and speed
+    colors = []
+    for channel in range(3):
+        state_colors = []
+        for speed in range(Organism.MIN_SPEED, Organism.MAX_SPEED + 1):
+            speed_rate = (speed - Organism.MIN_SPEED) / (Organism.MAX_SPEED - Organism.MIN_SPEED)
+            rgb = [0.45 if c == channel else 0.1 for c in range(3)]
+            state_colors.append(to_hex([c + c * speed_rate for c in rgb]))
+        colors.append(state_colors)
+    return colors
+
+ORGANISM_COLORS = organism_colors()
+
+def agent_portrayal(agent: Union[Agent, PheromoneTrail]):
     portrayal = {
         'Filled': 'true',
         'Layer': 0
@@ -46,25 +64,23 @@ def agent_portrayal(agent: Agent):
         w = 0.2 + 0.4 * (agent.size - Organism.MIN_SIZE) / (Organism.MAX_SIZE - Organism.MIN_SIZE)
         h = 0.2 + 0.4 * (agent.awareness - Organism.MIN_AWARENESS) / (Organism.MAX_AWARENESS - Organism.MIN_AWARENESS)
 
-        speed_rate = (agent.speed - Organism.MIN_SPEED) / (Organism.MAX_SPEED - Organism.MIN_SPEED)
-
-        r = 0.45 if agent.prob_survival < 1 else 0.1
-        g = 0.45 if agent.prob_survival == 1 and agent.prob_replication < 1 else 0.1
-        b = 0.45 if agent.prob_replication == 1 else 0.1
+        # Red until the organism can survive, then green until it can replicate, then blue
+        if agent.prob_survival < 1:
+            state = 0
+        elif agent.prob_replication < 1:
+            state = 1
+        else:
+            state = 2
 
         portrayal['Shape'] = 'rect'
-        portrayal['Color'] = to_hex([
-            r + r * speed_rate,
-            g + g * speed_rate,
-            b + b * speed_rate
-        ])
+        portrayal['Color'] = ORGANISM_COLORS[state][agent.speed - Organism.MIN_SPEED]
         portrayal['w'] = w
         portrayal['h'] = h
         portrayal['xAlign'] = 0.9 - w / 2
         portrayal['yAlign'] = 0.9 - h / 2
 
         for attr in ['age', 'speed', 'awareness', 'size', 'energy', 'trail', 'prob_survival', 'prob_replication']:
-            portrayal[attr] = agent.__dict__.get(attr)
+            portrayal[attr] = getattr(agent, attr)
     elif isinstance(agent, PheromoneTrail):
         offset = (agent.came_from[0] - agent.pos[0], agent.came_from[1] - agent.pos[1])
         portrayal['Shape'] = f'images/arrow_{offset_to_coordinate(offset)}.png'
@@ -72,8 +88,9 @@ def agent_portrayal(agent: Agent):
 
     return portrayal
 
-def create_server(model_args: Dict[str, Any]) -> ModularServer:
-    grid = CanvasGrid(agent_portrayal, model_args['width'], model_args['height'], 750, 750)
+def create_server(model_args: Dict[str, Any], background: bool = False,
+        sampling: str = 'generation', replay: str = None) -> ModularServer:
+    grid = DeltaCanvasGrid(agent_portrayal, model_args['width'], model_args['height'], 750, 750)
 
     # Charts
     num_organisms = GenerationChartModule(
@@ -115,7 +132,10 @@ def create_server(model_args: Dict[str, Any]) -> ModularServer:
         color='#DDAA00'
     )
     hist_size = HistogramModule(
-        bins=list(np.arange(Organism.MIN_SIZE, Organism.MAX_SIZE + 0.125, 0.125)),
+        bins=[
+            Organism.MIN_SIZE + 0.125 * i
+            for i in range(round((Organism.MAX_SIZE - Organism.MIN_SIZE) / 0.125) + 1)
+        ],
         attribute='size',
         color='#AA00DD'
     )
@@ -140,12 +160,27 @@ def create_server(model_args: Dict[str, Any]) -> ModularServer:
     if model_args['size_mutation_rate'] != 0.0:
         elements.append(hist_size)
 
-    return ModularServer(
-        NSModel,
-        [
-            generation, grid, num_organisms, average_age, hist_age, properties,
-            trail_percentage, hist_speed, hist_awareness, hist_size
-        ],
-        'Natural Selection Model',
-        model_args
-    )
+    visualization_elements = [
+        generation, grid, num_organisms, average_age, hist_age, properties,
+        trail_percentage, hist_speed, hist_awareness, hist_size
+    ]
+
+    model_cls, model_params, name = NSModel, model_args, 'Natural Selection Model'
+    if replay is not None:
+        # Played back from the generation chosen in the page
+        from recording import ReplayModel, TrajectoryReader
+        reader = TrajectoryReader(replay)
+        if not reader.starts:
+            raise ValueError(f'{replay} has no recorded generations')
+        model_cls, name = ReplayModel, 'Natural Selection Model (Replay)'
+        model_params = {
+            'path': replay,
+            'generation': Slider('Generation', min(reader.starts), min(reader.starts),
+                reader.generations()),
+        }
+        reader.close()
+
+    if background:
+        return BackgroundServer(model_cls, visualization_elements, name, model_params,
+            sampling=sampling)
+    return ModularServer(model_cls, visualization_elements, name, model_params)
@@ -0,0 +1,311 @@
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Type
+
+from mesa import Agent
+from mesa.space import MultiGrid
+
+@lru_cache(maxsize=None)
+def visibility_offsets(radius: int) -> Tuple[Tuple[int, int], ...]:
+    # Von Neumann neighborhood offsets (center excluded) in the order in which a full scan
+    # of the neighborhood settles on a target: greater squared distance first, ties broken
+    # by cell order
+    offsets = [
+        (dx, dy)
+        for dx in range(-radius, radius + 1)
+        for dy in range(-radius, radius + 1)
+        if 0 < abs(dx) + abs(dy) <= radius
+    ]
+    offsets.sort(key=lambda o: (-(o[0] * o[0] + o[1] * o[1]), o[0], o[1]))
+    return tuple(offsets)
+
+# Moore neighborhood offsets (center excluded) in the order of MultiGrid.get_neighborhood
+MOORE_OFFSETS = tuple((dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy)
+
+# Neighborhoods of the cells of a grid, computed as they are needed. Cells at the same
+# distances from the borders (up to the radius) have the same neighborhood offsets, so there
+# are only a few of them for each radius, however large the grid is. Cells away from the
+# borders, which are most of them, are looked up first.
+class Neighborhoods:
+    width: int
+    height: int
+
+    def __init__(self) -> None:
+        self.adjacency: Dict[Tuple[bool, bool, bool, bool], Tuple[Tuple[int, int], ...]] = {}
+        self.visibility: Dict[Tuple[int, int, int, int, int], Tuple[int, ...]] = {}
+        self.interior_visibility: Dict[int, Tuple[int, ...]] = {}
+
+    def adjacent(self, pos: Tuple[int, int]) -> Tuple[Tuple[int, int], ...]:
+        # Same cells as get_neighborhood(pos, moore=True), in the same order
+        x, y = pos
+        if 0 < x < self.width - 1 and 0 < y < self.height - 1:
+            return ((x - 1, y - 1), (x - 1, y), (x - 1, y + 1), (x, y - 1), (x, y + 1),
+                (x + 1, y - 1), (x + 1, y), (x + 1, y + 1))
+
+        key = (x == 0, x == self.width - 1, y == 0, y == self.height - 1)
+        offsets = self.adjacency.get(key)
+        if offsets is None:
+            offsets = self.adjacency[key] = tuple(
+                (dx, dy) for dx, dy in MOORE_OFFSETS
+                if 0 <= x + dx < self.width and 0 <= y + dy < self.height
+            )
+        return tuple((x + dx, y + dy) for dx, dy in offsets)
+
+    def visibility_deltas(self, pos: Tuple[int, int], radius: int) -> Tuple[int, ...]:
+        # Cell number offsets of the Von Neumann neighborhood of pos, in visibility order
+        x, y = pos
+        width, height = self.width, self.height
+        if radius <= x < width - radius and radius <= y < height - radius:
+            deltas = self.interior_visibility.get(radius)
+            if deltas is None:
+                deltas = self.interior_visibility[radius] = tuple(
+                    dx * height + dy for dx, dy in visibility_offsets(radius))
+            return deltas
+
+        key = (radius, min(x, radius), min(width - 1 - x, radius),
+            min(y, radius), min(height - 1 - y, radius))
+        deltas = self.visibility.get(key)
+        if deltas is None:
+            deltas = self.visibility[key] = tuple(
+                dx * height + dy for dx, dy in visibility_offsets(radius)
+                if 0 <= x + dx < width and 0 <= y + dy < height
+            )
+        return deltas
+
+# MultiGrid that also keeps the agents of each indexed type in per-cell buckets (in order of
+# arrival), so that lookups for a single type don't go through every agent in the cells.
+# Cells are numbered x * height + y, so that lookups don't build coordinate lists or check
+# bounds.
+class IndexedGrid(MultiGrid, Neighborhoods):
+    def __init__(self, width: int, height: int, indexed: Tuple[Type[Agent], ...]) -> None:
+        MultiGrid.__init__(self, width, height, torus=False)
+        Neighborhoods.__init__(self)
+        self.buckets: Dict[Type[Agent], List[List[Agent]]] = {
+            agent_type: [[] for _ in range(width * height)] for agent_type in indexed
+        }
+
+        # Cells of indexed agents that changed since the set was last taken, and a version for
+        # each cell, which is a new number every time the cell changes
+        self.changed: Set[int] = set()
+        self.versions = [0] * (width * height)
+        self.version = 0
+
+    def touch(self, pos: Tuple[int, int]):
+        i = pos[0] * self.height + pos[1]
+        self.version += 1
+        self.versions[i] = self.version
+        self.changed.add(i)
+
+    def index(self, pos: Tuple[int, int]) -> int:
+        return pos[0] * self.height + pos[1]
+
+    def place_agent(self, agent: Agent, pos: Tuple[int, int]) -> None:
+        buckets = self.buckets.get(type(agent))
+        if buckets is not None:
+            cell = buckets[pos[0] * self.height + pos[1]]
+            if agent not in cell:
+                cell.append(agent)
+            self.touch(pos)
+        super().place_agent(agent, pos)
+
+    def remove_agent(self, agent: Agent) -> None:
+        buckets = self.buckets.get(type(agent))
+        if buckets is not None:
+            buckets[agent.pos[0] * self.height + agent.pos[1]].remove(agent)
+            self.touch(agent.pos)
+        super().remove_agent(agent)
+
+    def place_agents(self, agents: Iterable[Agent], positions: Iterable[Tuple[int, int]]):
+        # Same as placing each agent in turn, for agents that aren't on the grid
+        grid, height = self.grid, self.height
+        for agent, pos in zip(agents, positions):
+            x, y = pos
+            grid[x][y].append(agent)
+            self.empties.discard(pos)
+            agent.pos = pos
+
+            buckets = self.buckets.get(type(agent))
+            if buckets is not None:
+                i = x * height + y
+                buckets[i].append(agent)
+                self.version += 1
+                self.versions[i] = self.version
+                self.changed.add(i)
+
+    def clear_cells(self, cells: Iterable[Tuple[int, int]]):
+        # Removes every agent in the given cells at once
+        for pos in cells:
+            x, y = pos
+            contents = self.grid[x][y]
+            if contents:
+                for agent in contents:
+                    agent.pos = None
+                contents.clear()
+
+                i = x * self.height + y
+                for buckets in self.buckets.values():
+                    buckets[i].clear()
+                self.empties.add(pos)
+                self.touch(pos)
+
+    def move_agent(self, agent: Agent, pos: Tuple[int, int]) -> None:
+        self.remove_agent(agent)
+        self.place_agent(agent, pos)
+
+    def cell_agents(self, agent_type: Type[Agent], pos: Tuple[int, int]) -> List[Agent]:
+        return self.buckets[agent_type][pos[0] * self.height + pos[1]]
+
+    def select(self, agent_type: Type[Agent], pos: Tuple[int, int], radius: int,
+            accept: Optional[Callable[[Agent], bool]] = None) -> Optional[Agent]:
+        # First accepted agent of the given type in visibility order, which is the agent a
+        # full scan over the Von Neumann neighborhood of pos would select
+        buckets = self.buckets[agent_type]
+        i = pos[0] * self.height + pos[1]
+
+        for delta in self.visibility_deltas(pos, radius):
+            for agent in buckets[i + delta]:
+                if accept is None or accept(agent):
+                    return agent
+
+        return None
+
+# Dict whose missing keys read as a default value, which isn't stored
+class SparseCells(dict):
+    def __init__(self, default: Any) -> None:
+        super().__init__()
+        self.default = default
+
+    def __missing__(self, key):
+        return self.default
+
+# Grid with the same interface as IndexedGrid that only stores the cells that have agents in
+# them, for very large and mostly empty worlds. Memory scales with the number of agents instead
+# of the number of cells. Agents in a cell are in the same order as in an IndexedGrid, so both
+# grids give the same runs.
+class SparseGrid(Neighborhoods):
+    def __init__(self, width: int, height: int, indexed: Tuple[Type[Agent], ...]) -> None:
+        super().__init__()
+        self.width = width
+        self.height = height
+        self.torus = False
+
+        # Agents of each occupied cell, by position, and of each indexed type, by cell number
+        self.contents: Dict[Tuple[int, int], List[Agent]] = {}
+        self.buckets: Dict[Type[Agent], SparseCells] = {
+            agent_type: SparseCells(()) for agent_type in indexed
+        }
+
+        # Same as in IndexedGrid, except that empty cells have no version
+        self.changed: Set[int] = set()
+        self.versions = SparseCells(0)
+        self.version = 0
+
+    def touch(self, pos: Tuple[int, int]):
+        i = pos[0] * self.height + pos[1]
+        self.version += 1
+        self.versions[i] = self.version
+        self.changed.add(i)
+
+    def index(self, pos: Tuple[int, int]) -> int:
+        return pos[0] * self.height + pos[1]
+
+    def place_agent(self, agent: Agent, pos: Tuple[int, int]) -> None:
+        cell = self.contents.get(pos)
+        if cell is None:
+            cell = self.contents[pos] = []
+        if agent not in cell:
+            cell.append(agent)
+        agent.pos = pos
+
+        buckets = self.buckets.get(type(agent))
+        if buckets is not None:
+            i = pos[0] * self.height + pos[1]
+            bucket = buckets.get(i)
+            if bucket is None:
+                bucket = buckets[i] = []
+            if agent not in bucket:
+                bucket.append(agent)
+            self.touch(pos)
+
+    def remove_agent(self, agent: Agent) -> None:
+        pos = agent.pos
+        i = pos[0] * self.height + pos[1]
+
+        buckets = self.buckets.get(type(agent))
+        if buckets is not None:
+            bucket = buckets[i]
+            bucket.remove(agent)
+            if not bucket:
+                del buckets[i]
+            self.touch(pos)
+
+        cell = self.contents[pos]
+        cell.remove(agent)
+        if not cell:
+            del self.contents[pos]
+            self.versions.pop(i, None)
+        agent.pos = None
+
+    def place_agents(self, agents: Iterable[Agent], positions: Iterable[Tuple[int, int]]):
+        for agent, pos in zip(agents, positions):
+            self.place_agent(agent, pos)
+
+    def clear_cells(self, cells: Iterable[Tuple[int, int]]):
+        for pos in cells:
+            contents = self.contents.pop(pos, None)
+            if contents:
+                for agent in contents:
+                    agent.pos = None
+
+                i = pos[0] * self.height + pos[1]
+                for buckets in self.buckets.values():
+                    buckets.pop(i, None)
+                self.touch(pos)
+                del self.versions[i]
+
+    def move_agent(self, agent: Agent, pos: Tuple[int, int]) -> None:
+        self.remove_agent(agent)
+        self.place_agent(agent, pos)
+
+    def cell_agents(self, agent_type: Type[Agent], pos: Tuple[int, int]) -> List[Agent]:
+        return self.buckets[agent_type][pos[0] * self.height + pos[1]]
+
+    def get_cell_list_contents(self, cell_list: Iterable[Tuple[int, int]]) -> List[Agent]:
+        contents = self.contents
+        return [agent for pos in cell_list for agent in contents.get(pos, ())]
+
+    def select(self, agent_type: Type[Agent], pos: Tuple[int, int], radius: int,
+            accept: Optional[Callable[[Agent], bool]] = None) -> Optional[Agent]:
+        buckets = self.buckets[agent_type]
+        i = pos[0] * self.height + pos[1]
+
+        for delta in self.visibility_deltas(pos, radius):
+            for agent in buckets.get(i + delta, ()):
+                if accept is None or accept(agent):
+                    return agent
+
+        return None
+
+# Cells on the border of a grid, numbered left column, right column, then bottom and top rows,
+# and cells inside the border, numbered by column, so that they can be sampled without listing
+# them. Grids less than 3 cells wide or high are all border.
+def border_size(width: int, height: int) -> int:
+    if width <= 2 or height <= 2:
+        return width * height
+    return 2 * (width + height) - 4
+
+def border_position(i: int, width: int, height: int) -> Tuple[int, int]:
+    if width <= 2 or height <= 2:
+        return divmod(i, height)
+    if i < 2 * height:
+        return (0 if i < height else width - 1, i % height)
+    i -= 2 * height
+    return (1 + i % (width - 2), 0 if i < width - 2 else height - 1)
+
+def center_size(width: int, height: int) -> int:
+    if width <= 2 or height <= 2:
+        return 0
+    return (width - 2) * (height - 2)
+
+def center_position(i: int, width: int, height: int) -> Tuple[int, int]:
+    x, y = divmod(i, height - 2)
+    return (x + 1, y + 1)
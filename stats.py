@@ -0,0 +1,78 @@
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+from mesa import Agent
+
+# Running sums and histograms of organism attributes, updated as organisms are born, die or
+# change, so that averages and histograms can be read without going through the population.
+class PopulationStats:
+    def __init__(self, attributes: Sequence[str]) -> None:
+        # Changes whenever the population or an attribute changes
+        self.version = 0
+        self.count = 0
+        self.sums: Dict[str, Any] = {attr: 0 for attr in attributes}
+        self.histograms: Dict[Tuple[str, Tuple[float, ...]], List[int]] = {}
+
+    @staticmethod
+    def bin_index(edges: Tuple[float, ...], value) -> int:
+        # Same binning as numpy.histogram: the last bin also includes its right edge
+        if value == edges[-1]:
+            return len(edges) - 2
+        i = bisect_right(edges, value) - 1
+        return i if 0 <= i < len(edges) - 1 else -1
+
+    def count_in_histograms(self, agent: Agent, delta: int):
+        for (attr, edges), counts in self.histograms.items():
+            i = PopulationStats.bin_index(edges, getattr(agent, attr))
+            if i >= 0:
+                counts[i] += delta
+
+    def add(self, agent: Agent):
+        self.version += 1
+        self.count += 1
+        for attr in self.sums:
+            self.sums[attr] += getattr(agent, attr)
+        self.count_in_histograms(agent, 1)
+
+    def remove(self, agent: Agent):
+        self.version += 1
+        self.count -= 1
+        for attr in self.sums:
+            self.sums[attr] -= getattr(agent, attr)
+        self.count_in_histograms(agent, -1)
+
+    def update(self, agent: Agent, attribute: str, old_value):
+        # Must be called after the attribute of the agent has changed
+        new_value = getattr(agent, attribute)
+        self.version += 1
+        if attribute in self.sums:
+            self.sums[attribute] += new_value - old_value
+
+        for (attr, edges), counts in self.histograms.items():
+            if attr == attribute:
+                old, new = PopulationStats.bin_index(edges, old_value), PopulationStats.bin_index(edges, new_value)
+                if old >= 0:
+                    counts[old] -= 1
+                if new >= 0:
+                    counts[new] += 1
+
+    def tracks(self, attribute: str) -> bool:
+        return attribute in self.sums
+
+    def average(self, attribute: str) -> float:
+        return self.sums[attribute] / self.count if self.count != 0 else 0.0
+
+    def histogram(self, attribute: str, bins: Sequence[float], population: Iterable[Agent]) -> List[int]:
+        # The population is only gone through the first time a histogram is requested
+        key = (attribute, tuple(float(b) for b in bins))
+        counts = self.histograms.get(key)
+
+        if counts is None:
+            counts = [0] * (len(bins) - 1)
+            for agent in population:
+                i = PopulationStats.bin_index(key[1], getattr(agent, attribute))
+                if i >= 0:
+                    counts[i] += 1
+            self.histograms[key] = counts
+
+        return list(counts)
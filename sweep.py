@@ -0,0 +1,130 @@
+import csv
+import hashlib
+import inspect
+import itertools
+from argparse import ArgumentParser, HelpFormatter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Any, List, Tuple
+
+from headless import (add_termination_arguments, collected_data, run_model, termination_criteria,
+    termination_reason)
+from model import NSModel, Organism
+
+def model_parameters() -> Dict[str, Any]:
+    return {
+        name: param.default
+        for name, param in inspect.signature(NSModel.__init__).parameters.items()
+        if name not in ('self', 'seed')
+    }
+
+def parse_parameter(defaults: Dict[str, Any], name: str, value: str) -> Any:
+    # Values are converted to the type of the parameter's default (bool('False') would be True)
+    default = defaults[name]
+    if isinstance(default, bool):
+        if value.lower() in ('true', '1'):
+            return True
+        if value.lower() in ('false', '0'):
+            return False
+        raise ValueError(f'invalid value for {name}: {value} (expected true, false, 1 or 0)')
+    return type(default)(value)
+
+def parameter_grid(grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    names = list(grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+def run_seed(base_seed: int, config: int, replicate: int) -> int:
+    digest = hashlib.sha256(f'{base_seed}:{config}:{replicate}'.encode()).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+def init_worker(energy: float):
+    Organism.MAX_ENERGY = energy
+
+def run_replicate(
+        model_args: Dict[str, Any], generations: int, termination: Dict[str, Any] = None
+    ) -> Tuple[List[str], List[List[Any]], str]:
+    model = run_model(model_args, generations, termination)
+    data = collected_data(model)
+    return list(data.keys()), [list(row) for row in zip(*data.values())], termination_reason(model)
+
+def run_sweep(
+        grid: Dict[str, List[Any]], replicates: int, generations: int, output: str,
+        base_seed: int = 0, base_args: Dict[str, Any] = None,
+        energy: float = Organism.MAX_ENERGY, workers: int = None,
+        termination: Dict[str, Any] = None
+    ):
+    configs = parameter_grid(grid)
+    names = list(grid.keys())
+    base_args = base_args or {}
+
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(energy,)) as executor, \
+            open(output, 'w', newline='') as f:
+        tasks = {}
+        for c, config in enumerate(configs):
+            for r in range(replicates):
+                seed = run_seed(base_seed, c, r)
+                model_args = {**base_args, **config, 'seed': seed}
+                future = executor.submit(run_replicate, model_args, generations, termination)
+                tasks[future] = (c, r, seed)
+
+        writer = csv.writer(f)
+        header = False
+
+        # Rows are streamed to the output as soon as each run finishes
+        for future in as_completed(tasks):
+            c, r, seed = tasks[future]
+            columns, rows, reason = future.result()
+
+            if not header:
+                writer.writerow(['Config', 'Replicate', 'Seed'] + names + ['Generation'] + columns
+                    + ['Termination'])
+                header = True
+
+            # Runs stopped early have fewer rows, all with the reason they were stopped for
+            params = [configs[c][name] for name in names]
+            for i, row in enumerate(rows):
+                writer.writerow([c, r, seed] + params + [i + 1] + row + [reason])
+            f.flush()
+
+def main():
+    def formatter(prog):
+        return HelpFormatter(prog, max_help_position=40)
+
+    parser = ArgumentParser(description='Parameter sweep over the natural selection simulation',
+        formatter_class=formatter)
+
+    parser.add_argument('-p', '--param', metavar='NAME=V1,V2', action='append', default=[],
+        help='model parameter and the values it takes in the sweep (can be repeated)')
+    parser.add_argument('-r', '--replicates', metavar='R', type=int, default=10,
+        help='number of seeds to run for each configuration')
+    parser.add_argument('-g', '--generations', metavar='G', type=int, default=100,
+        help='number of generations to simulate in each run')
+    parser.add_argument('-s', '--seed', metavar='S', type=int, default=0,
+        help='base seed from which the seed of each run is derived')
+    parser.add_argument('-e', '--energy', metavar='E', type=float, default=150.0,
+        help='starting (maximum) energy of organisms')
+    parser.add_argument('-j', '--workers', metavar='J', type=int, default=None,
+        help='number of worker processes (defaults to the number of cores)')
+    parser.add_argument('-o', '--output', metavar='O', default='sweep.csv',
+        help='file to write the consolidated results to')
+    add_termination_arguments(parser)
+
+    args = parser.parse_args()
+    termination = termination_criteria(vars(args))
+
+    defaults = model_parameters()
+    grid = {}
+    for param in args.param:
+        name, _, values = param.partition('=')
+        name = name.replace('-', '_')
+        if name not in defaults:
+            parser.error(f'unknown model parameter: {name}')
+        try:
+            grid[name] = [parse_parameter(defaults, name, v) for v in values.split(',')]
+        except ValueError as e:
+            parser.error(str(e))
+
+    run_sweep(grid, args.replicates, args.generations, args.output, args.seed,
+        energy=args.energy, workers=args.workers, termination=termination)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from mesa import Model
+
+# Series that must settle for a run to have converged, by data collector
+CONVERGENCE_SERIES = {
+    'dc_properties': ('Speed', 'Awareness', 'Size'),
+    'dc_trail_percentage': ('Trail Percentage',),
+}
+
+# Criteria for stopping a run before its last generation, checked by the model at the start of
+# every generation, after its data has been collected. A run stops when the population goes
+# extinct, when it grows past a cap, or when every series of CONVERGENCE_SERIES has stayed
+# within an (absolute) tolerance over the last window generations.
+class Termination:
+    def __init__(self, extinction: bool = False, max_organisms: Optional[int] = None,
+            tolerance: Optional[float] = None, window: int = 10) -> None:
+        if window < 2:
+            raise ValueError('the convergence window must be at least 2 generations')
+
+        self.extinction = extinction
+        self.max_organisms = max_organisms
+        self.tolerance = tolerance
+        self.window = window
+
+        # Latest values of each series, since models may only keep the latest one
+        self.history: Dict[str, Deque[float]] = {
+            name: deque(maxlen=window)
+            for names in CONVERGENCE_SERIES.values() for name in names
+        }
+        self.reason: Optional[str] = None
+
+    def check(self, model: Model) -> Optional[str]:
+        if self.extinction and model.num_organisms == 0:
+            self.reason = 'extinction'
+        elif self.max_organisms is not None and model.num_organisms > self.max_organisms:
+            self.reason = 'population cap'
+        elif self.tolerance is not None and self.converged(model):
+            self.reason = 'convergence'
+        return self.reason
+
+    def converged(self, model: Model) -> bool:
+        for collector, names in CONVERGENCE_SERIES.items():
+            model_vars = getattr(model, collector).model_vars
+            for name in names:
+                self.history[name].append(model_vars[name][-1])
+
+        return all(
+            len(values) == self.window and max(values) - min(values) <= self.tolerance
+            for values in self.history.values()
+        )
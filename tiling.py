@@ -0,0 +1,352 @@
+import multiprocessing
+import traceback
+from collections import namedtuple
+from multiprocessing.connection import Connection, wait
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from model import Food, NSModel, Organism, PheromoneTrail
+from stats import PopulationStats
+
+# Genes and age of an organism between generations, sent to and from the tiles
+Genes = namedtuple('Genes', ('unique_id', 'speed', 'awareness', 'size', 'trail', 'age'))
+
+# Sent by a tile that raised an exception instead of its reply, before its worker exits
+TileFailure = namedtuple('TileFailure', ('tile', 'error', 'traceback'))
+
+# State of an organism that crosses into another tile, besides its position and food positions
+MIGRANT_FIELDS = ('unique_id', 'speed', 'awareness', 'size', 'trail', 'trail_length', 'age',
+    'energy', 'prob_survival', 'prob_replication', 'next_move')
+
+def tile_bounds(width: int, tiles: int) -> List[Tuple[int, int]]:
+    # Columns [x0, x1) owned by each tile
+    return [(width * t // tiles, width * (t + 1) // tiles) for t in range(tiles)]
+
+# Model of a single tile, run by a worker process. The world is split into vertical strips and
+# each tile steps the organisms, food and trails of its own strip. Agents of the neighboring
+# strips within sight of it (the halo, as wide as the greatest awareness in the generation, up
+# to MAX_AWARENESS) are copied into the tile as ghosts after every tick, so that organisms see
+# across the edges, and organisms that move out of the strip are handed off to the neighbor
+# that owns their new cell, along with the trails they left there. Ghosts are on the grid but
+# not in the schedule, and the halo cells are never activated.
+class TileModel(NSModel):
+    def __init__(self, tile: int, tiles: int, left: Optional[Connection],
+            right: Optional[Connection], **model_args) -> None:
+        super().__init__(**model_args, num_organisms=0, food_per_generation=0, sparse=True)
+
+        self.tile = tile
+        self.tile_count = tiles
+        self.x0, self.x1 = tile_bounds(self.width, tiles)[tile]
+        self.halo = max(1, Organism.MAX_AWARENESS)  # Set for each generation by populate
+
+        # Edges are exchanged in two rounds (edges to the right of even tiles first) and the
+        # tile on the left of each edge sends first, so large messages can't deadlock
+        edges = [(left, False), (right, True)]
+        if tile % 2 == 0:
+            edges.reverse()
+        self.edges = [(conn, sends_first) for conn, sends_first in edges if conn is not None]
+        self.left = left
+        self.right = right
+
+        self.ghosts: List[Any] = []
+        self.ghost_pools: Dict[type, List[Any]] = {Organism: [], Food: []}
+
+    def next_id(self) -> int:
+        # Unique across tiles
+        self.current_id += 1
+        return self.current_id * self.tile_count + self.tile
+
+    def tick(self):
+        self.step_agents()
+        self.share()
+
+    def share(self):
+        # Hands off migrants and trails and refreshes the ghosts on both sides
+        contents, height = self.grid.contents, self.height
+        scheduled = self.schedule._agents
+        sides = [
+            (self.left, self.x0 - 1, range(self.x0, min(self.x0 + self.halo, self.x1))),
+            (self.right, self.x1, range(max(self.x1 - self.halo, self.x0), self.x1)),
+        ]
+
+        outgoing = {}
+        for conn, outside, halo in sides:
+            if conn is None:
+                continue
+            migrants, trails, organisms, food = outgoing[conn] = ([], [], [], [])
+
+            # Organisms that left the strip are in the column next to it, along with ghosts.
+            # The only trails outside the strip are the ones they left there.
+            for y in range(height):
+                for agent in contents.get((outside, y), ()):
+                    if scheduled.get(agent.unique_id) is agent:
+                        state = tuple(getattr(agent, field) for field in MIGRANT_FIELDS)
+                        migrants.append((state, agent.pos, list(agent.food_positions)))
+
+                        trail = self.trails.cells.pop(agent.pos, None)
+                        if trail is not None:
+                            trails.append((trail.pos, trail.creator, trail.came_from,
+                                trail.strength))
+
+            for state, pos, _ in migrants:
+                self.remove_agent(scheduled[state[0]])
+
+            for x in halo:
+                for y in range(height):
+                    for agent in contents.get((x, y), ()):
+                        if isinstance(agent, Organism):
+                            organisms.append((agent.unique_id, agent.pos, agent.size))
+                        else:
+                            food.append((agent.unique_id, agent.pos, None))
+
+        incoming = []
+        for conn, sends_first in self.edges:
+            if sends_first:
+                conn.send(outgoing[conn])
+                incoming.append(conn.recv())
+            else:
+                incoming.append(conn.recv())
+                conn.send(outgoing[conn])
+
+        self.clear_ghosts()
+        for migrants, trails, organisms, food in incoming:
+            for state, pos, food_positions in migrants:
+                self.receive_migrant(state, pos, food_positions)
+            for pos, creator, came_from, strength in trails:
+                self.trails.cells[pos] = PheromoneTrail(pos, creator, came_from, strength)
+            for unique_id, pos, size in organisms:
+                self.place_ghost(Organism, unique_id, pos).size = size
+            for unique_id, pos, _ in food:
+                self.place_ghost(Food, unique_id, pos)
+
+        # Halo cells only have ghosts in them, which must not be activated
+        grid = self.grid
+        grid.changed = {i for i in grid.changed if self.x0 <= i // grid.height < self.x1}
+
+    def receive_migrant(self, state: Sequence[Any], pos: Tuple[int, int], food_positions):
+        organism = self.new_organism(*state[1:5])
+        for field, value in zip(MIGRANT_FIELDS, state):
+            setattr(organism, field, value)
+        if food_positions:
+            organism.food_positions = set(food_positions)
+
+        self.schedule.add(organism)
+        self.stats.add(organism)
+        self.grid.place_agent(organism, pos)
+
+    def place_ghost(self, agent_type: type, unique_id: int, pos: Tuple[int, int]):
+        pool = self.ghost_pools[agent_type]
+        ghost = pool.pop() if pool else agent_type(self)
+        ghost.unique_id = unique_id
+        self.grid.place_agent(ghost, pos)
+        self.ghosts.append(ghost)
+        return ghost
+
+    def clear_ghosts(self):
+        self.grid.clear_cells([ghost.pos for ghost in self.ghosts])
+        for ghost in self.ghosts:
+            self.ghost_pools[type(ghost)].append(ghost)
+        self.ghosts.clear()
+
+    def survive(self) -> List[Genes]:
+        # Survival and replication of the tile's organisms, which are then taken off the tile
+        occupied = [agent.pos for agent in self.schedule.agents]
+        survivors, replicas = self.select_survivors()
+
+        population = []
+        for organism in survivors + replicas:
+            population.append(Genes(organism.unique_id, organism.speed, organism.awareness,
+                organism.size, organism.trail, organism.age))
+            self.stats.remove(organism)
+            self.organism_pool.append(organism)
+
+        self.clear_ghosts()
+        self.grid.clear_cells(occupied)
+        self.schedule.replace(())
+        self.trails.clear()
+        return population
+
+    def populate(self, organisms: List[Tuple[Genes, Tuple[int, int]]],
+            food: List[Tuple[int, int]], halo: int):
+        self.halo = halo
+
+        agents = []
+        for genes, _ in organisms:
+            organism = self.new_organism(genes.speed, genes.awareness, genes.size, genes.trail)
+            if genes.unique_id is not None:
+                organism.unique_id = genes.unique_id
+            organism.age = genes.age
+            self.schedule.add(organism)
+            self.stats.add(organism)
+            agents.append(organism)
+        self.grid.place_agents(agents, [pos for _, pos in organisms])
+
+        food_agents = [self.new_food() for _ in food]
+        for agent in food_agents:
+            self.schedule.add(agent)
+        self.grid.place_agents(food_agents, food)
+
+        self.share()
+
+def run_tile(tile: int, tiles: int, model_args: Dict[str, Any], constants: Dict[str, Any],
+        control: Connection, left: Optional[Connection], right: Optional[Connection]):
+    # Worker process loop. Ticks aren't answered, so the tiles run ahead of the main process
+    # and only wait on each other until the end of the generation.
+    for name, value in constants.items():
+        setattr(Organism, name, value)
+
+    try:
+        model = TileModel(tile, tiles, left, right, **model_args)
+
+        while True:
+            command, *args = control.recv()
+            if command == 'tick':
+                model.tick()
+            elif command == 'survive':
+                control.send(model.survive())
+            elif command == 'populate':
+                model.populate(*args)
+            elif command == 'stop':
+                break
+    except Exception as e:
+        # Neighbors may see the edges close and fail in turn (with an EOFError)
+        control.send(TileFailure(tile, type(e).__name__, traceback.format_exc()))
+
+# Runs a model split into tiles, each one stepped by a worker process (see TileModel). The main
+# model only takes part at generation boundaries, when the tiles send back the next population,
+# which is placed on the whole world as usual and sent to the tiles that own each cell, and
+# merged into the model's statistics. Runs are statistically equivalent to, but not the same
+# as, a single process run, since ghosts are a tick behind and each tile has its own generator.
+class TiledEngine:
+    ATTRIBUTES = ('speed', 'awareness', 'size', 'age', 'trail')
+
+    def __init__(self, model: NSModel, tiles: int, initial_speed: int, initial_awareness: int,
+            initial_size: float, initial_trail: float) -> None:
+        self.model = model
+        self.owner = [
+            t for t, (x0, x1) in enumerate(tile_bounds(model.width, tiles)) for _ in range(x0, x1)
+        ]
+
+        params = model.parameters
+        seed = params['seed']
+        constants = {name: value for name, value in vars(Organism).items() if name.isupper()}
+
+        context = multiprocessing.get_context()
+        edges = [context.Pipe() for _ in range(tiles - 1)]
+        self.workers: List[Connection] = []
+        self.processes = []
+
+        for t in range(tiles):
+            model_args = {
+                'seed': None if seed is None else f'{seed}:{t}',
+                'width': model.width, 'height': model.height,
+                'speed_mutation_rate': model.speed_mutation_rate,
+                'awareness_mutation_rate': model.awareness_mutation_rate,
+                'size_mutation_rate': model.size_mutation_rate,
+            }
+            left = edges[t - 1][1] if t > 0 else None
+            right = edges[t][0] if t < tiles - 1 else None
+
+            control, worker_control = context.Pipe()
+            process = context.Process(target=run_tile, daemon=True,
+                args=(t, tiles, model_args, constants, worker_control, left, right))
+            process.start()
+            self.workers.append(control)
+            self.processes.append(process)
+
+            # Only the worker keeps its ends open, so that it sees the main process go away
+            worker_control.close()
+
+        # Likewise, a worker that exits closes the edges of its neighbors
+        for left, right in edges:
+            left.close()
+            right.close()
+
+        population = [
+            Genes(None, initial_speed, initial_awareness, initial_size,
+                i < model.num_organisms * initial_trail, 0)
+            for i in range(model.num_organisms)
+        ]
+        self.populate(population)
+
+    def populate(self, population: List[Genes]):
+        model = self.model
+        organisms = [[] for _ in self.workers]
+        for genes, pos in zip(population, model.border_sample(len(population))):
+            organisms[self.owner[pos[0]]].append((genes, pos))
+
+        food = [[] for _ in self.workers]
+        for pos in model.center_sample(model.food_per_generation):
+            food[self.owner[pos[0]]].append(pos)
+
+        # Awareness doesn't change during a generation, so nothing further away can be seen
+        halo = max((genes.awareness for genes in population), default=0)
+        for worker, tile_organisms, tile_food in zip(self.workers, organisms, food):
+            worker.send(('populate', tile_organisms, tile_food, max(1, halo)))
+
+        model.stats = PopulationStats(TiledEngine.ATTRIBUTES)
+        for genes in population:
+            model.stats.add(genes)
+        model.num_organisms = len(population)
+
+    def send(self, message: Tuple):
+        for worker in self.workers:
+            try:
+                worker.send(message)
+            except OSError:
+                self.fail()
+
+    def receive(self, worker: Connection) -> Any:
+        # Forked workers inherit the ends of their neighbors' pipes, so a worker stuck on a
+        # neighbor that failed may never see its edge close. The main process gives up as soon
+        # as any worker exits instead.
+        ready = wait([worker] + [process.sentinel for process in self.processes])
+        if worker not in ready:
+            self.fail()
+
+        try:
+            reply = worker.recv()
+        except EOFError:
+            reply = None
+        if reply is None or isinstance(reply, TileFailure):
+            self.fail()
+        return reply
+
+    def fail(self):
+        # Stops every worker and raises the exception of the tile that failed first, rather
+        # than those of its neighbors, which only failed because its edges were closed
+        wait([process.sentinel for process in self.processes], timeout=1)
+
+        failures = []
+        for worker in self.workers:
+            try:
+                while worker.poll():
+                    reply = worker.recv()
+                    if isinstance(reply, TileFailure):
+                        failures.append(reply)
+            except (EOFError, OSError):
+                pass
+        failures.sort(key=lambda failure: failure.error == 'EOFError')
+
+        for process in self.processes:
+            process.terminate()
+            process.join()
+        self.workers.clear()
+        self.processes.clear()
+
+        if failures:
+            raise RuntimeError(f'tile {failures[0].tile} failed:\n{failures[0].traceback}')
+        raise RuntimeError('a tile worker stopped unexpectedly')
+
+    def step(self):
+        self.send(('tick',))
+
+    def new_generation(self):
+        self.send(('survive',))
+        self.populate([genes for worker in self.workers for genes in self.receive(worker)])
+
+    def close(self):
+        self.send(('stop',))
+        for process in self.processes:
+            process.join()
+        self.workers.clear()
+        self.processes.clear()
@@ -0,0 +1,365 @@
+import numpy as np
+
+from mesa import Model
+
+from model import Organism, PheromoneTrail
+from spatial import visibility_offsets
+
+# Moore neighborhood offsets, in cell order
+ADJACENT_OFFSETS = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy])
+
+# Struct-of-arrays engine for NSModel: every organism is an index into the arrays below and
+# each tick is computed for the whole population at once. Within a tick, all organisms eat
+# before any of them moves, and movement decisions are made on the state at the start of the
+# movement phase, so runs are statistically equivalent to (not identical with) the agent engine.
+# Several independent replicates of the world can be run in lockstep: each organism belongs to
+# a replicate, the world arrays have a leading replicate axis and cells are numbered across all
+# replicates, so organisms of different replicates never meet.
+class ArrayEngine:
+    FIELDS = ('ids', 'replicate', 'x', 'y', 'speed', 'awareness', 'size', 'trail', 'age', 'energy',
+        'prob_survival', 'prob_replication', 'move_ticks', 'trail_length')
+
+    def __init__(
+            self, model: Model, width: int, height: int, num_organisms: int,
+            speed: int, awareness: int, size: float, trail: float, replicates: int = 1
+        ) -> None:
+        self.model = model
+        self.width = width
+        self.height = height
+        self.replicates = replicates
+        self.rng = np.random.default_rng(model.random.getrandbits(64))
+
+        n = num_organisms * replicates
+        self.ids = np.arange(n, dtype=np.int64)
+        self.next_id = n
+        self.replicate = np.repeat(np.arange(replicates, dtype=np.int64), num_organisms)
+        self.x = np.zeros(n, dtype=np.int64)
+        self.y = np.zeros(n, dtype=np.int64)
+
+        # Genes
+        self.speed = np.full(n, speed, dtype=np.int64)
+        self.awareness = np.full(n, awareness, dtype=np.int64)
+        self.size = np.full(n, size, dtype=np.float64)
+        self.trail = np.tile(np.arange(num_organisms) < num_organisms * trail, replicates)
+
+        self.age = np.zeros(n, dtype=np.int64)
+        self.trail_length = np.zeros(n, dtype=np.int64)
+        self.move_ticks = 1 + Organism.MAX_SPEED - self.speed
+        self.reset()
+
+        shape = (replicates, width, height)
+        self.food = np.zeros(shape, dtype=np.float64)
+
+        # Only the most recent trail in each cell is kept
+        self.trail_strength = np.zeros(shape, dtype=np.int8)
+        self.trail_creator = np.full(shape, -1, dtype=np.int64)
+        self.trail_from_x = np.zeros(shape, dtype=np.int32)
+        self.trail_from_y = np.zeros(shape, dtype=np.int32)
+
+        self.place_organisms()
+        self.place_food()
+
+    def __len__(self) -> int:
+        return self.ids.size
+
+    def reset(self):
+        n = len(self)
+        self.energy = np.full(n, Organism.MAX_ENERGY, dtype=np.float64)
+        self.prob_survival = np.zeros(n, dtype=np.float64)
+        self.prob_replication = np.zeros(n, dtype=np.float64)
+
+        # Keys (id * cells + cell) of the food cells each organism is following a trail from
+        self.food_positions = np.empty(0, dtype=np.int64)
+
+    def select(self, index: np.ndarray):
+        for field in ArrayEngine.FIELDS:
+            setattr(self, field, getattr(self, field)[index])
+
+    def place_organisms(self):
+        w, h = self.width, self.height
+        border = np.unique(np.concatenate([
+            np.arange(h),
+            np.arange(w) * h,
+            (w - 1) * h + np.arange(h),
+            np.arange(w) * h + h - 1
+        ]))
+
+        # Positions are sampled for the organisms of each replicate separately
+        cells = np.empty(len(self), dtype=np.int64)
+        order = np.argsort(self.replicate, kind='stable')
+        ends = np.cumsum(self.counts())
+        for members in np.split(order, ends[:-1]):
+            cells[members] = self.rng.choice(border, size=members.size,
+                replace=border.size < members.size)
+        self.x, self.y = np.divmod(cells, h)
+
+    def place_food(self):
+        self.food.fill(0.0)
+        inner_height = self.height - 2
+        for r in range(self.replicates):
+            cells = self.rng.choice((self.width - 2) * inner_height,
+                size=self.model.food_per_generation, replace=False)
+            self.food[r, 1 + cells // inner_height, 1 + cells % inner_height] = 1.0
+
+    def cells(self) -> np.ndarray:
+        return (self.replicate * self.width + self.x) * self.height + self.y
+
+    def eat(self, index: np.ndarray, amount):
+        ps = self.prob_survival[index]
+        used_for_survival = np.minimum(amount, 1.0 - ps)
+        self.prob_survival[index] = ps + used_for_survival
+
+        pr = self.prob_replication[index]
+        self.prob_replication[index] = pr + np.minimum(amount - used_for_survival, 1.0 - pr)
+
+    @staticmethod
+    def first_per_cell(candidates: np.ndarray, cell: np.ndarray, rank: np.ndarray) -> np.ndarray:
+        # The candidate that acts first (lowest rank) in each of the cells
+        order = candidates[np.lexsort((rank[candidates], cell[candidates]))]
+        return order[np.unique(cell[order], return_index=True)[1]]
+
+    def eat_food(self, cell: np.ndarray, rank: np.ndarray):
+        food = self.food.reshape(-1)
+        cells = food.size
+
+        candidates = np.flatnonzero(food[cell] > 0)
+        if self.food_positions.size:
+            keys = self.ids[candidates] * cells + cell[candidates]
+            candidates = candidates[~np.isin(keys, self.food_positions)]
+
+        # Organisms sharing a cell with food eat from it in activation order
+        while candidates.size:
+            eaters = ArrayEngine.first_per_cell(candidates, cell, rank)
+            c = cell[eaters]
+            available = food[c]
+            trail = self.trail[eaters]
+
+            amount = np.where(trail, np.minimum(0.5, available), available)
+            leaves = trail & (available > 0.5)
+            self.food_positions = np.concatenate(
+                [self.food_positions, self.ids[eaters[leaves]] * cells + c[leaves]])
+            self.trail_length[eaters[leaves]] = Organism.MAX_TRAIL_LENGTH
+
+            hungry = self.prob_replication[eaters] < 1.0
+            self.eat(eaters[hungry], amount[hungry])
+            food[c[hungry]] -= amount[hungry]
+
+            candidates = np.setdiff1d(candidates, eaters, assume_unique=True)
+            candidates = candidates[food[cell[candidates]] > 0]
+
+    def eat_organisms(self, cell: np.ndarray, rank: np.ndarray) -> np.ndarray:
+        eaten = np.zeros(len(self), dtype=bool)
+        _, group, counts = np.unique(cell, return_inverse=True, return_counts=True)
+        crowded = np.flatnonzero(counts[group] > 1)
+        if not crowded.size:
+            return eaten
+
+        # In each crowded cell, organisms act in activation order, each eating every smaller
+        # organism it is allowed to (in cell order) until it can't replicate any further
+        done = np.zeros(len(self), dtype=bool)
+        while True:
+            live = crowded[~eaten[crowded]]
+
+            # Smallest organism without and with the trail gene in each cell
+            smallest = np.full((2, counts.size), np.inf)
+            np.minimum.at(smallest, (self.trail[live].astype(np.int64), group[live]), self.size[live])
+
+            # Organisms that can't eat anything now won't be able to later in the tick either
+            candidates = live[~done[live]]
+            g, size = group[candidates], self.size[candidates]
+            hungry = (self.prob_replication[candidates] < 1.0) & (
+                (size > smallest[0, g]) | (~self.trail[candidates] & (size > smallest[1, g])))
+            done[candidates[~hungry]] = True
+            candidates = candidates[hungry]
+            if not candidates.size:
+                break
+
+            predators = ArrayEngine.first_per_cell(candidates, group, rank)
+            predator_of = np.full(counts.size, -1, dtype=np.int64)
+            predator_of[group[predators]] = predators
+
+            predator = predator_of[group[live]]
+            prey = live[predator >= 0]
+            predator = predator[predator >= 0]
+
+            edible = (self.size[predator] > self.size[prey]) & ~(self.trail[predator] & self.trail[prey])
+            prey, predator = prey[edible], predator[edible]
+
+            first = np.unique(group[prey], return_index=True)[1]
+            prey, predator = prey[first], predator[first]
+
+            self.eat(predator, 1.0)
+            eaten[prey] = True
+
+        return eaten
+
+    def find(self, movers: np.ndarray, present) -> np.ndarray:
+        # Position of the first cell in visibility order for which present(movers, x, y) holds,
+        # or -1 if there is none within each mover's awareness
+        target = np.full((movers.size, 2), -1, dtype=np.int64)
+        mx, my = self.x[movers], self.y[movers]
+        awareness = self.awareness[movers]
+
+        for dx, dy in visibility_offsets(Organism.MAX_AWARENESS):
+            pending = np.flatnonzero((target[:, 0] < 0) & (awareness >= abs(dx) + abs(dy)))
+            if not pending.size:
+                continue
+
+            cx, cy = mx[pending] + dx, my[pending] + dy
+            inside = (cx >= 0) & (cx < self.width) & (cy >= 0) & (cy < self.height)
+            pending, cx, cy = pending[inside], cx[inside], cy[inside]
+
+            hit = present(movers[pending], cx, cy)
+            target[pending[hit], 0] = cx[hit]
+            target[pending[hit], 1] = cy[hit]
+
+        return target
+
+    def move(self):
+        self.move_ticks -= 1
+        movers = np.flatnonzero(self.move_ticks == 0)
+        if not movers.size:
+            return
+        self.move_ticks[movers] = 1 + Organism.MAX_SPEED - self.speed[movers]
+
+        largest = np.zeros(self.food.shape, dtype=np.float64)
+        np.maximum.at(largest, (self.replicate, self.x, self.y), self.size)
+        threat = self.find(movers, lambda m, x, y:
+            largest[self.replicate[m], x, y] / self.size[m] > 1 + Organism.SIZE_TO_EAT)
+        food = self.find(movers, lambda m, x, y: self.food[self.replicate[m], x, y] > 0)
+
+        mr, mx, my = self.replicate[movers], self.x[movers], self.y[movers]
+        ax = mx[:, None] + ADJACENT_OFFSETS[:, 0]
+        ay = my[:, None] + ADJACENT_OFFSETS[:, 1]
+        inside = (ax >= 0) & (ax < self.width) & (ay >= 0) & (ay < self.height)
+
+        # Random adjacent cell by default
+        choice = np.argmax(np.cumsum(inside, axis=1) >
+            np.floor(self.rng.random(movers.size) * inside.sum(axis=1))[:, None], axis=1)
+        nx, ny = ax[np.arange(movers.size), choice], ay[np.arange(movers.size), choice]
+
+        # Follow a foreign trail in the current cell with probability proportional to its strength
+        strength = self.trail_strength[mr, mx, my]
+        follows = (
+            self.trail[movers] & (strength > 0) &
+            (self.trail_creator[mr, mx, my] != self.ids[movers]) &
+            (self.rng.random(movers.size) <= strength / PheromoneTrail.MAX_STRENGTH)
+        )
+        nx[follows] = self.trail_from_x[mr[follows], mx[follows], my[follows]]
+        ny[follows] = self.trail_from_y[mr[follows], mx[follows], my[follows]]
+
+        # Approach food, or flee from threats (which take precedence)
+        for target, flee in ((food, False), (threat, True)):
+            has = target[:, 0] >= 0
+            d2 = (ax[has] - target[has, :1]) ** 2 + (ay[has] - target[has, 1:]) ** 2
+            if flee:
+                best = np.argmax(np.where(inside[has], d2, -1), axis=1)
+            else:
+                best = np.argmin(np.where(inside[has], d2, np.iinfo(np.int64).max), axis=1)
+            nx[has], ny[has] = ax[has][np.arange(best.size), best], ay[has][np.arange(best.size), best]
+
+        distance_moved = np.sqrt((nx - mx) ** 2 + (ny - my) ** 2)
+        required = Organism.energy_cost(self.size[movers], self.speed[movers],
+            self.awareness[movers], distance_moved)
+        able = self.energy[movers] >= required
+
+        movers, required = movers[able], required[able]
+        mr, mx, my, nx, ny = mr[able], mx[able], my[able], nx[able], ny[able]
+        self.energy[movers] -= required
+        self.x[movers], self.y[movers] = nx, ny
+
+        leaves = self.trail_length[movers] > 0
+        movers, mr, mx, my = movers[leaves], mr[leaves], mx[leaves], my[leaves]
+        nx, ny = nx[leaves], ny[leaves]
+        self.trail_strength[mr, nx, ny] = (PheromoneTrail.MAX_STRENGTH -
+            (Organism.MAX_TRAIL_LENGTH - self.trail_length[movers]))
+        self.trail_creator[mr, nx, ny] = self.ids[movers]
+        self.trail_from_x[mr, nx, ny] = mx
+        self.trail_from_y[mr, nx, ny] = my
+        self.trail_length[movers] -= 1
+
+    def step(self):
+        phase = self.model.phase
+
+        # Trails decay at the start of the tick after the one they were left in
+        with phase('trail_decay'):
+            np.subtract(self.trail_strength, 1, out=self.trail_strength, where=self.trail_strength > 0)
+
+        rank = self.rng.permutation(len(self))
+        cell = self.cells()
+        with phase('eat_food'):
+            self.eat_food(cell, rank)
+
+        with phase('eat_organisms'):
+            eaten = self.eat_organisms(cell, rank)
+            if eaten.any():
+                self.select(~eaten)
+                self.model.num_organisms -= int(eaten.sum())
+
+        with phase('move'):
+            self.move()
+
+    def mutate(self, genes: np.ndarray, rate: float, delta, lower, upper) -> np.ndarray:
+        mutates = self.rng.random(genes.size) <= rate
+        genes[mutates] = np.clip(genes[mutates] + delta(int(mutates.sum())), lower, upper)
+        return genes
+
+    def new_generation(self):
+        with self.model.phase('generation:survival'):
+            self.replace_population()
+
+        with self.model.phase('generation:placement'):
+            self.place_organisms()
+            self.place_food()
+            self.trail_strength.fill(0)
+
+    def replace_population(self):
+        n = len(self)
+        survives = self.rng.random(n) <= self.prob_survival
+        replicates = survives & (self.rng.random(n) <= self.prob_replication)
+        parents = np.flatnonzero(replicates)
+
+        step = lambda k: np.where(self.rng.integers(0, 2, k) == 1, 1, -1)
+        children = {
+            'ids': np.arange(self.next_id, self.next_id + parents.size, dtype=np.int64),
+            'replicate': self.replicate[parents],
+            'x': np.zeros(parents.size, dtype=np.int64),
+            'y': np.zeros(parents.size, dtype=np.int64),
+            'speed': self.mutate(self.speed[parents], self.model.speed_mutation_rate, step,
+                Organism.MIN_SPEED, Organism.MAX_SPEED),
+            'awareness': self.mutate(self.awareness[parents], self.model.awareness_mutation_rate,
+                step, Organism.MIN_AWARENESS, Organism.MAX_AWARENESS),
+            'size': self.mutate(self.size[parents], self.model.size_mutation_rate,
+                lambda k: 2 * Organism.MAX_SIZE_MUTATION * self.rng.random(k) - Organism.MAX_SIZE_MUTATION,
+                Organism.MIN_SIZE, Organism.MAX_SIZE),
+            'trail': self.trail[parents],
+            'age': np.zeros(parents.size, dtype=np.int64),
+            'trail_length': np.zeros(parents.size, dtype=np.int64),
+        }
+        children['move_ticks'] = 1 + Organism.MAX_SPEED - children['speed']
+        self.next_id += parents.size
+
+        self.select(survives)
+        self.age += 1
+        for field, values in children.items():
+            setattr(self, field, np.concatenate([getattr(self, field), values]))
+
+        self.reset()
+        self.model.num_organisms = len(self)
+
+    def property_average(self, prop_name: str) -> float:
+        values = getattr(self, prop_name)
+        return float(values.mean()) if values.size != 0 else 0.0
+
+    def trail_percentage(self) -> float:
+        return 100 * float(self.trail.mean()) if self.trail.size != 0 else 0.0
+
+    def counts(self) -> np.ndarray:
+        # Number of organisms in each replicate
+        return np.bincount(self.replicate, minlength=self.replicates)
+
+    def replicate_averages(self, prop_name: str) -> np.ndarray:
+        counts = self.counts()
+        sums = np.bincount(self.replicate, weights=getattr(self, prop_name),
+            minlength=self.replicates)
+        return np.divide(sums, counts, out=np.zeros(self.replicates), where=counts != 0)
@@ -1,11 +1,30 @@
 
-import numpy as np
 import json
+from typing import Any, Callable, Dict, Hashable
 
 from mesa.visualization.ModularVisualization import VisualizationElement, CHART_JS_FILE
+from mesa.visualization.modules import CanvasGrid
 from mesa import Model
 
-from model import Organism
+# Render cache of a visualization element. Elements key their output on whatever it depends on
+# (a tick, a generation or a version of the population), and are only rendered again when the
+# model or the key change. Otherwise None is sent, and the browser keeps showing the previous
+# output, so frames in which nothing an element shows changed cost a comparison.
+class RenderCache:
+    def __init__(self) -> None:
+        self.model = None
+        self.key = None
+
+    def render(self, model: Model, key: Hashable, render: Callable[[Model], Any]) -> Any:
+        if model is self.model and key == self.key:
+            return None
+
+        self.model = model
+        self.key = key
+        return render(model)
+
+def tick(model: Model) -> Hashable:
+    return (model.generation, model.step_count)
 
 class HistogramModule(VisualizationElement):
     package_includes = [CHART_JS_FILE]
@@ -23,6 +42,7 @@ class HistogramModule(VisualizationElement):
         self.canvas_width = canvas_width
         self.canvas_height = canvas_height
         self.attribute = attribute
+        self.cache = RenderCache()
 
         new_element = 'new HistogramModule({}, {}, {}, {}, {})'.format(
             bins, canvas_width, canvas_height, repr(attribute.capitalize()),
@@ -32,13 +52,11 @@ class HistogramModule(VisualizationElement):
         self.js_code = 'elements.push(' + new_element + ');'
     
     def render(self, model: Model):
-        values = [
-            agent.__getattribute__(self.attribute)
-            for agent in model.schedule.agents
-            if isinstance(agent, Organism)
-        ]
-        hist = np.histogram(values, bins=self.bins)[0]
-        return [int(x) for x in hist]
+        # Histograms only change with the population
+        return self.cache.render(model, (model.stats, model.stats.version), self.histogram)
+
+    def histogram(self, model: Model):
+        return model.stats.histogram(self.attribute, self.bins, model.organisms())
 
 class GenerationChartModule(VisualizationElement):
     package_includes = [CHART_JS_FILE]
@@ -55,7 +73,9 @@ class GenerationChartModule(VisualizationElement):
         self.canvas_width = canvas_width
         self.canvas_height = canvas_height
         self.data_collector_name = data_collector_name
+        self.model = None
         self.generation = None
+        self.cache = RenderCache()
 
         series_json = json.dumps(self.series)
         new_element = 'new GenerationChartModule({}, {},  {})'
@@ -63,20 +83,95 @@ class GenerationChartModule(VisualizationElement):
         self.js_code = 'elements.push(' + new_element + ');'
 
     def render(self, model: Model):
-        if self.generation == model.generation:
-            return None
+        return self.cache.render(model, model.generation, self.new_rows)
+
+    def new_rows(self, model: Model):
+        # Every generation since the last frame is sent, so that no point is missing from the
+        # chart when frames are only sampled from a model running ahead of the browser
+        if model is not self.model:
+            self.model = model
+            new_generations = model.generation
         else:
-            self.generation = model.generation
+            new_generations = model.generation - self.generation
+        self.generation = model.generation
 
-        current_values = []
         data_collector = getattr(model, self.data_collector_name)
+        columns = []
 
         for s in self.series:
             name = s['Label']
-            try:
-                val = data_collector.model_vars[name][-1]  # Latest value
-            except (IndexError, KeyError):
-                val = 0
-            current_values.append(val)
+            values = data_collector.model_vars.get(name, [])[-new_generations:]
+            columns.append(values if values else [0])
+
+        # Rows are of the latest generations, which don't start at 1 for replays of resumed runs
+        rows = [list(row) for row in zip(*columns)]
+        return {'generation': model.generation - len(rows) + 1, 'rows': rows}
+
+class DeltaCanvasGrid(CanvasGrid):
+    # Grid that only sends the portrayals added, changed or removed since the previous frame.
+    # Portrayals are keyed by agent (and by cell for pheromone trails, which aren't agents), and
+    # a full keyframe is sent periodically and whenever the model is replaced by a reset.
+    local_includes = ['DeltaCanvasModule.js']
+
+    def __init__(
+        self,
+        portrayal_method,
+        grid_width: int,
+        grid_height: int,
+        canvas_width: int = 500,
+        canvas_height: int = 500,
+        keyframe_interval: int = 100
+    ):
+        super().__init__(portrayal_method, grid_width, grid_height, canvas_width, canvas_height)
+        self.keyframe_interval = keyframe_interval
+        self.model = None
+        self.frame = 0
+        self.portrayals: Dict[str, Dict[str, Any]] = {}
+        self.cache = RenderCache()
+
+        new_element = 'new DeltaCanvasModule({}, {}, {}, {})'.format(
+            canvas_width, canvas_height, grid_width, grid_height
+        )
+        self.js_code = 'elements.push(' + new_element + ');'
+
+    def current_portrayals(self, model: Model) -> Dict[str, Dict[str, Any]]:
+        portrayals = {}
+
+        for agent in model.schedule.agents:
+            portrayal = self.portrayal_method(agent)
+            if portrayal:
+                portrayal['x'], portrayal['y'] = agent.pos
+                portrayals[f'a{agent.unique_id}'] = portrayal
+
+        for trail in model.trails.trails():
+            portrayal = self.portrayal_method(trail)
+            if portrayal:
+                portrayal['x'], portrayal['y'] = trail.pos
+                portrayals[f't{trail.pos[0]},{trail.pos[1]}'] = portrayal
+
+        return portrayals
+
+    def render(self, model: Model):
+        return self.cache.render(model, tick(model), self.delta)
+
+    def delta(self, model: Model):
+        portrayals = self.current_portrayals(model)
+
+        if model is not self.model or self.frame % self.keyframe_interval == 0:
+            self.model = model
+            self.frame = 0
+            frame = {'keyframe': True, 'update': portrayals, 'remove': []}
+        else:
+            previous = self.portrayals
+            frame = {
+                'keyframe': False,
+                'update': {
+                    key: portrayal for key, portrayal in portrayals.items()
+                    if previous.get(key) != portrayal
+                },
+                'remove': [key for key in previous if key not in portrayals],
+            }
 
-        return current_values
+        self.frame += 1
+        self.portrayals = portrayals
+        return frame